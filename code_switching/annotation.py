@@ -0,0 +1,380 @@
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+import numpy as np
+
+from .cache import InferenceCache, model_revision
+from .models import (
+    backend_device,
+    load_config,
+    load_token_classifier,
+    load_tokenizer,
+)
+
+if TYPE_CHECKING:
+    from transformers import PretrainedConfig
+
+LID_PRETRAINED = "sagorsarker/codeswitch-spaeng-lid-lince"
+POS_PRETRAINED = "sagorsarker/codeswitch-spaeng-pos-lince"
+
+iso_lookup = {"en": "eng", "spa": "spa"}
+languages = list(iso_lookup.values())
+
+
+@dataclass
+class TokenPredictions:
+    """
+    Token-level LID and POS predictions for a list of texts.
+
+    Arrays are flattened across all texts, in text order; `text_idx` holds
+    the index of the text each token came from. Special tokens are dropped.
+    `lid` and `pos` are label ids into `AnnotationLabels.lid_labels` and
+    `AnnotationLabels.pos_labels`.
+    """
+
+    text_idx: np.ndarray
+    token_index: np.ndarray
+    word_idx: np.ndarray
+    tokens: List[str]
+    lid: np.ndarray
+    lid_score: np.ndarray
+    pos: np.ndarray
+    pos_score: np.ndarray
+
+
+@dataclass
+class WordPredictions:
+    """
+    Word-level annotations aggregated from `TokenPredictions`.
+
+    Words are numbered in token order; `token_word` maps each token to its
+    word. `lang` and `pos` are value ids into `AnnotationLabels.lang_values`
+    and `AnnotationLabels.pos_labels`.
+
+    Each language switch between two consecutive tokens of a text produces a
+    "from" annotation for the earlier token, attached to the later token's
+    word, and an "into" annotation for the later token, attached to the
+    earlier token's word. Switch arrays hold these in that order.
+    """
+
+    token_word: np.ndarray
+    text_idx: np.ndarray
+    word_idx: np.ndarray
+    surface_form: List[str]
+    lang: np.ndarray
+    lang_confidence: np.ndarray
+    pos: np.ndarray
+    pos_confidence: np.ndarray
+    switch_token: np.ndarray
+    switch_word: np.ndarray
+    switch_into: np.ndarray
+    switch_confidence: np.ndarray
+
+
+@dataclass
+class AnnotationLabels:
+    """
+    Label vocabularies of the LID and POS models.
+
+    LID labels collapse onto ISO 639-3 codes in `lang_values`, with
+    everything else mapped to "n/a"; `lid_to_lang` maps label ids to
+    indices into `lang_values`.
+    """
+
+    lid_labels: List[str]
+    pos_labels: List[str]
+    lang_values: List[str]
+    lid_to_lang: np.ndarray
+    switch_langs: np.ndarray
+
+    @classmethod
+    def from_configs(
+        cls, lid_config: "PretrainedConfig", pos_config: "PretrainedConfig"
+    ) -> "AnnotationLabels":
+        lid_labels = [lid_config.id2label[i] for i in range(lid_config.num_labels)]
+        pos_labels = [pos_config.id2label[i] for i in range(pos_config.num_labels)]
+        lid_langs = [iso_lookup.get(label, "n/a") for label in lid_labels]
+        lang_values = sorted(set(lid_langs))
+        return cls(
+            lid_labels=lid_labels,
+            pos_labels=pos_labels,
+            lang_values=lang_values,
+            lid_to_lang=np.array([lang_values.index(l) for l in lid_langs]),
+            switch_langs=np.array([l in languages for l in lang_values]),
+        )
+
+    @classmethod
+    def from_pretrained(
+        cls, lid_pretrained: str, pos_pretrained: str
+    ) -> "AnnotationLabels":
+        return cls.from_configs(
+            load_config(lid_pretrained), load_config(pos_pretrained)
+        )
+
+
+def weighted_vote(
+    groups: np.ndarray,
+    values: np.ndarray,
+    weights: np.ndarray,
+    n_groups: int,
+    n_values: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pick the value with the largest total weight in each group.
+
+    Returns the winning value per group and its share of the group's total
+    weight.
+    """
+    votes = np.zeros((n_groups, n_values))
+    np.add.at(votes, (groups, values), weights)
+    winner = votes.argmax(axis=1)
+    confidence = votes[np.arange(n_groups), winner] / votes.sum(axis=1)
+    return winner, confidence
+
+
+@dataclass
+class PreparedTexts:
+    """
+    Texts ready for `FusedAnnotator.predict`: cached per-text predictions,
+    and tokenized batches (text indices and encodings) for the rest.
+    """
+
+    texts: List[str]
+    per_text: List[dict]
+    keys: List[str] = field(default_factory=list)
+    batches: List[Tuple[List[int], Tuple[dict, List[dict]]]] = field(
+        default_factory=list
+    )
+
+
+class FusedAnnotator:
+    """
+    Runs the LID and POS token classifiers on a single shared tokenization.
+
+    Both LINCE models are fine-tuned from the same base model, so each batch
+    is tokenized once and both heads are run on the same `input_ids`. Word
+    indices are read from that same encoding.
+
+    With a `cache`, each text's token predictions are stored under the text
+    and both models' revisions and backends, and only texts not seen before
+    are run through the models.
+
+    `lid_backend` and `pos_backend` pick an inference backend from
+    `models.BACKENDS` for each model; any backend other than "torch" runs
+    on the CPU. `script/check_backends.py` measures how much they change
+    the predictions.
+    """
+
+    def __init__(
+        self,
+        lid_pretrained: str,
+        pos_pretrained: str,
+        batch_size: int = 32,
+        cache: Optional[InferenceCache] = None,
+        lid_backend: str = "torch",
+        pos_backend: str = "torch",
+    ):
+        self.lid_pretrained = lid_pretrained
+        self.pos_pretrained = pos_pretrained
+        self.batch_size = batch_size
+        self.cache = cache
+        self.lid_backend = lid_backend
+        self.pos_backend = pos_backend
+        self.device = backend_device(lid_backend, pos_backend)
+        self.tokenizer = load_tokenizer(lid_pretrained)
+        pos_tokenizer = load_tokenizer(pos_pretrained)
+        if pos_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+            raise ValueError(
+                f"{lid_pretrained} and {pos_pretrained} don't share a tokenizer"
+            )
+
+        self.lid_model = load_token_classifier(lid_pretrained, self.device, lid_backend)
+        self.pos_model = load_token_classifier(pos_pretrained, self.device, pos_backend)
+        self.labels = AnnotationLabels.from_configs(
+            self.lid_model.config, self.pos_model.config
+        )
+
+    def cache_key(self, text: str) -> str:
+        return InferenceCache.key(
+            "annotate",
+            self.lid_pretrained,
+            model_revision(self.lid_model.config),
+            self.lid_backend,
+            self.pos_pretrained,
+            model_revision(self.pos_model.config),
+            self.pos_backend,
+            text,
+        )
+
+    def annotate(self, texts: List[str]) -> TokenPredictions:
+        return self.predict(self.prepare(texts))
+
+    def prepare(self, texts: List[str]) -> PreparedTexts:
+        """
+        Look texts up in the cache and tokenize the rest, in batches of
+        similar length to keep padding small.
+
+        This is the CPU-bound, model-free half of `annotate`; `predict` runs
+        the models. They can run in different threads.
+        """
+        prepared = PreparedTexts(texts, [{} for _ in texts])
+        todo = list(range(len(texts)))
+        if self.cache is not None:
+            prepared.keys = [self.cache_key(text) for text in texts]
+            cached = self.cache.get_many(set(prepared.keys))
+            todo = [i for i in todo if prepared.keys[i] not in cached]
+            for i, key in enumerate(prepared.keys):
+                if key in cached:
+                    prepared.per_text[i] = cached[key]
+
+        order = sorted(todo, key=lambda i: len(texts[i]))
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start : start + self.batch_size]
+            prepared.batches.append((batch, self.encode([texts[i] for i in batch])))
+        return prepared
+
+    def predict(self, prepared: PreparedTexts) -> TokenPredictions:
+        per_text = prepared.per_text
+        for batch, encoding in prepared.batches:
+            for i, predictions in zip(batch, self.predict_batch(encoding)):
+                per_text[i] = predictions
+        if self.cache is not None:
+            self.cache.put_many(
+                {
+                    prepared.keys[i]: per_text[i]
+                    for batch, _ in prepared.batches
+                    for i in batch
+                }
+            )
+
+        columns = {}
+        for key in ("token_index", "word_idx", "lid", "lid_score", "pos", "pos_score"):
+            columns[key] = np.concatenate(
+                [p[key] for p in per_text] or [np.empty(0, np.int64)]
+            )
+        return TokenPredictions(
+            text_idx=np.repeat(
+                np.arange(len(per_text)), [len(p["token_index"]) for p in per_text]
+            ),
+            tokens=[t for p in per_text for t in p["tokens"]],
+            **columns,
+        )
+
+    def aggregate(self, predictions: TokenPredictions) -> WordPredictions:
+        text_idx = predictions.text_idx
+        word_idx = predictions.word_idx
+        n_tokens = len(text_idx)
+
+        # Tokens of a word are contiguous, so a new word starts wherever the
+        # text or the word index changes.
+        new_word = np.ones(n_tokens, dtype=bool)
+        new_word[1:] = (text_idx[1:] != text_idx[:-1]) | (word_idx[1:] != word_idx[:-1])
+        token_word = np.cumsum(new_word) - 1
+        n_words = int(new_word.sum())
+
+        # Decide each word's annotation value by taking a vote across all of
+        # its tokens' values using the token-level confidence scores.
+        labels = self.labels
+        lang = labels.lid_to_lang[predictions.lid]
+        word_lang, lang_confidence = weighted_vote(
+            token_word, lang, predictions.lid_score, n_words, len(labels.lang_values)
+        )
+        word_pos, pos_confidence = weighted_vote(
+            token_word,
+            predictions.pos,
+            predictions.pos_score,
+            n_words,
+            len(labels.pos_labels),
+        )
+
+        # A switch happens between consecutive tokens of the same text whose
+        # languages differ, when both are one of `languages`.
+        is_lang = labels.switch_langs[lang]
+        (switch_at,) = np.nonzero(
+            (text_idx[1:] == text_idx[:-1])
+            & (lang[1:] != lang[:-1])
+            & is_lang[1:]
+            & is_lang[:-1]
+        )
+        prev, cur = switch_at, switch_at + 1
+        confidence = predictions.lid_score[prev] * predictions.lid_score[cur]
+
+        word_starts = np.flatnonzero(new_word)
+        surface_form = [
+            self.tokenizer.convert_tokens_to_string(predictions.tokens[start:end])
+            for start, end in zip(word_starts, np.append(word_starts[1:], n_tokens))
+        ]
+
+        return WordPredictions(
+            token_word=token_word,
+            text_idx=text_idx[new_word],
+            word_idx=word_idx[new_word],
+            surface_form=surface_form,
+            lang=word_lang,
+            lang_confidence=lang_confidence,
+            pos=word_pos,
+            pos_confidence=pos_confidence,
+            # Interleave (from, into) pairs
+            switch_token=np.column_stack([prev, cur]).ravel(),
+            switch_word=np.column_stack([token_word[cur], token_word[prev]]).ravel(),
+            switch_into=np.tile([False, True], len(switch_at)),
+            switch_confidence=np.repeat(confidence, 2),
+        )
+
+    def encode(self, texts: List[str]) -> Tuple[dict, List[dict]]:
+        """
+        Tokenize a batch of texts into model inputs, plus the token indices,
+        word indices and tokens kept for each text.
+        """
+        encoding = self.tokenizer(
+            texts,
+            padding=True,
+            truncation=True,
+            return_tensors="pt",
+            return_special_tokens_mask=True,
+        )
+        special_tokens_mask = encoding.pop("special_tokens_mask")
+        keep = (encoding["attention_mask"].bool() & ~special_tokens_mask.bool()).numpy()
+        input_ids = encoding["input_ids"].numpy()
+
+        rows = []
+        for row in range(len(texts)):
+            (token_index,) = np.nonzero(keep[row])
+            word_ids = encoding.word_ids(row)
+            rows.append(
+                {
+                    "token_index": token_index,
+                    "word_idx": np.array(
+                        [word_ids[i] for i in token_index], dtype=np.int64
+                    ),
+                    "tokens": self.tokenizer.convert_ids_to_tokens(
+                        input_ids[row, token_index].tolist()
+                    ),
+                }
+            )
+        return dict(encoding), rows
+
+    def predict_batch(self, encoded: Tuple[dict, List[dict]]) -> List[dict]:
+        import torch
+
+        encoding, rows = encoded
+        inputs = {k: v.to(self.device) for k, v in encoding.items()}
+        with torch.no_grad():
+            lid_scores, lid = self.lid_model(**inputs).logits.softmax(-1).max(-1)
+            pos_scores, pos = self.pos_model(**inputs).logits.softmax(-1).max(-1)
+        lid, lid_scores = lid.cpu().numpy(), lid_scores.float().cpu().numpy()
+        pos, pos_scores = pos.cpu().numpy(), pos_scores.float().cpu().numpy()
+
+        results = []
+        for row, kept in enumerate(rows):
+            token_index = kept["token_index"]
+            results.append(
+                {
+                    **kept,
+                    "lid": lid[row, token_index],
+                    "lid_score": lid_scores[row, token_index],
+                    "pos": pos[row, token_index],
+                    "pos_score": pos_scores[row, token_index],
+                }
+            )
+        return results
@@ -1,84 +1,681 @@
+import csv
+import re
+import string
+import subprocess
+import threading
+from dataclasses import dataclass
+from itertools import groupby
 from pathlib import Path
+from queue import Empty, Full, Queue
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
+import numpy as np
 import torch
-from transformers import WhisperForConditionalGeneration, WhisperTokenizer, pipeline
-
-
-def run_asr(path: Path, model_name: str = "openai/whisper-small"):
-    device = "cpu"
-    if torch.cuda.is_available():
-        device = "cuda:0"
-    elif torch.backends.mps.is_available():
-        device = "mps"
-
-    pipe = pipeline(
-        "automatic-speech-recognition",
-        model=model_name,
-        chunk_length_s=15,
-        device=device,
-        generate_kwargs={"task": "transcribe"},
+from transformers import (
+    WhisperFeatureExtractor,
+    WhisperForConditionalGeneration,
+    WhisperTokenizer,
+)
+from transformers.modeling_outputs import BaseModelOutput
+
+from .cache import InferenceCache, model_revision
+from .models import backend_device, load_asr_pipeline
+
+
+def stream_audio(
+    path: Path,
+    sampling_rate: int = 16000,
+    block_s: float = 30.0,
+    max_blocks: int = 4,
+) -> Iterator[np.ndarray]:
+    """
+    Decode and resample an audio file incrementally with ffmpeg.
+
+    A background thread reads fixed-size blocks of mono float32 samples from
+    ffmpeg into a bounded queue, so at most `max_blocks` blocks are held in
+    memory no matter how long the file is.
+    """
+    process = subprocess.Popen(
+        [
+            "ffmpeg",
+            "-nostdin",
+            "-loglevel",
+            "error",
+            "-i",
+            str(path),
+            "-ac",
+            "1",
+            "-ar",
+            str(sampling_rate),
+            "-f",
+            "f32le",
+            "-",
+        ],
+        stdout=subprocess.PIPE,
     )
+    assert process.stdout is not None
+    block_bytes = int(block_s * sampling_rate) * np.dtype(np.float32).itemsize
+    blocks: Queue[Optional[bytes]] = Queue(maxsize=max_blocks)
+    stop = threading.Event()
+
+    def read():
+        try:
+            while not stop.is_set():
+                data = process.stdout.read(block_bytes)  # type: ignore
+                if not data:
+                    break
+                while not stop.is_set():
+                    try:
+                        blocks.put(data, timeout=0.1)
+                        break
+                    except Full:
+                        continue
+        finally:
+            blocks.put(None)
+
+    reader = threading.Thread(target=read, daemon=True)
+    reader.start()
+    try:
+        remainder = b""
+        while (data := blocks.get()) is not None:
+            data = remainder + data
+            usable = len(data) - len(data) % np.dtype(np.float32).itemsize
+            remainder = data[usable:]
+            yield np.frombuffer(data[:usable], dtype=np.float32)
+        process.wait()
+    finally:
+        stop.set()
+        if process.poll() is None:
+            process.kill()
+        # Unblock the reader if it is waiting on a full queue.
+        try:
+            while True:
+                blocks.get_nowait()
+        except Empty:
+            pass
+        reader.join()
+        process.wait()
+    if process.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to decode {path}")
+
+
+@dataclass
+class EnergyVad:
+    """
+    Cheap voice activity detector based on frame energy.
+
+    A frame is active if it is louder than `threshold_db` (dBFS). With a
+    `min_band_ratio` above 0, at least that share of its energy must also
+    fall inside `band_hz`, which covers voiced speech down to low-pitched
+    voices and can reject rumble and hiss. A chunk counts as speech if at
+    least `min_speech_ratio` of its frames are active, which rejects
+    silences.
+
+    With `reject_music`, a chunk must also have the syllable rhythm of
+    speech: its energy envelope, band-passed to `syllable_hz`, must vary
+    by at least `min_modulation` of its mean. Sustained music such as pads,
+    chords and legato melodies barely varies at that rate, while speech
+    varies by well over half its mean. Plucked or percussive music with
+    notes at about syllable rate can still pass, and speech that is much
+    quieter than a music bed under it can be rejected.
+    """
+
+    frame_ms: float = 30.0
+    threshold_db: float = -45.0
+    band_hz: Tuple[float, float] = (80.0, 4000.0)
+    min_band_ratio: float = 0.0
+    min_speech_ratio: float = 0.1
+    reject_music: bool = False
+    syllable_hz: Tuple[float, float] = (2.0, 8.0)
+    min_modulation: float = 0.06
+
+    def frames(self, audio: np.ndarray, sampling_rate: int) -> np.ndarray:
+        frame_len = int(sampling_rate * self.frame_ms / 1000)
+        n_frames = len(audio) // frame_len
+        return audio[: n_frames * frame_len].reshape(n_frames, frame_len)
+
+    def active_frames(self, audio: np.ndarray, sampling_rate: int) -> np.ndarray:
+        frames = self.frames(audio, sampling_rate)
+        frame_len = frames.shape[1]
+
+        rms = np.sqrt(np.mean(frames**2, axis=1))
+        energy_db = 20 * np.log10(rms + 1e-10)
+        active = energy_db > self.threshold_db
+        if self.min_band_ratio <= 0:
+            return active
+
+        power = np.abs(np.fft.rfft(frames * np.hanning(frame_len), axis=1)) ** 2
+        freqs = np.fft.rfftfreq(frame_len, 1 / sampling_rate)
+        band = (freqs >= self.band_hz[0]) & (freqs <= self.band_hz[1])
+        band_ratio = power[:, band].sum(axis=1) / (power.sum(axis=1) + 1e-10)
+
+        return active & (band_ratio >= self.min_band_ratio)
+
+    def modulation(self, audio: np.ndarray, sampling_rate: int) -> float:
+        """
+        RMS of the energy envelope in the `syllable_hz` band, relative to
+        the envelope's mean.
+        """
+        envelope = np.sqrt(np.mean(self.frames(audio, sampling_rate) ** 2, axis=1))
+        n_frames = len(envelope)
+        if n_frames == 0:
+            return 0.0
+        power = np.abs(np.fft.rfft(envelope - envelope.mean())) ** 2
+        freqs = np.fft.rfftfreq(n_frames, self.frame_ms / 1000)
+        band = (freqs >= self.syllable_hz[0]) & (freqs <= self.syllable_hz[1])
+        # Parseval: the band's share of the envelope's variance
+        band_rms = np.sqrt(2 * power[band].sum()) / n_frames
+        return float(band_rms / (envelope.mean() + 1e-10))
+
+    def is_speech(self, audio: np.ndarray, sampling_rate: int) -> bool:
+        active = self.active_frames(audio, sampling_rate)
+        if active.size == 0 or active.mean() < self.min_speech_ratio:
+            return False
+        return (
+            not self.reject_music
+            or self.modulation(audio, sampling_rate) >= self.min_modulation
+        )
+
+
+@dataclass
+class AsrStats:
+    chunks: int = 0
+    audio_ms: int = 0
+    skipped_chunks: int = 0
+    skipped_ms: int = 0
+    decoded_chunks: int = 0
+    pruned_decodes: int = 0
+    cached_chunks: int = 0
+
+    def report(self) -> str:
+        return (
+            f"{self.chunks} chunks, {self.skipped_chunks} skipped by VAD "
+            f"({self.skipped_ms / 1000:.1f}s of {self.audio_ms / 1000:.1f}s), "
+            f"{self.pruned_decodes} of {2 * self.decoded_chunks} decodes pruned, "
+            f"{self.cached_chunks} cached"
+        )
+
+
+@dataclass
+class AudioChunk:
+    start_ms: int
+    end_ms: int
+    input_features: torch.Tensor
+
+
+def stream_chunks(
+    path: Path,
+    feature_extractor: WhisperFeatureExtractor,
+    chunk_length_s: float = 15,
+    stride_length_s: Optional[float] = None,
+    vad: Optional[EnergyVad] = None,
+    stats: Optional[AsrStats] = None,
+) -> Iterator[AudioChunk]:
+    """
+    Split an audio file into overlapping chunks as it is being decoded.
+
+    Chunk boundaries match the ones `transformers` uses for chunked
+    speech recognition, but only one chunk of audio is buffered at a time.
+    If a `vad` is given, chunks without speech are dropped before feature
+    extraction; the remaining chunks keep their original offsets.
+    """
+    sampling_rate = feature_extractor.sampling_rate
+    if stride_length_s is None:
+        stride_length_s = chunk_length_s / 6
+    chunk_len = int(round(chunk_length_s * sampling_rate))
+    stride = int(round(stride_length_s * sampling_rate))
+    step = chunk_len - 2 * stride
+
+    stats = stats or AsrStats()
+    # Samples already accounted for in `stats`, so overlaps aren't counted twice
+    covered = 0
+
+    def make_chunk(offset: int, audio: np.ndarray) -> Iterator[AudioChunk]:
+        nonlocal covered
+        end = offset + len(audio)
+        new_ms = (end - max(offset, covered)) * 1000 // sampling_rate
+        covered = end
+        stats.chunks += 1
+        stats.audio_ms += new_ms
+        if vad is not None and not vad.is_speech(audio, sampling_rate):
+            stats.skipped_chunks += 1
+            stats.skipped_ms += new_ms
+            return
+
+        features = feature_extractor(
+            audio, sampling_rate=sampling_rate, return_tensors="pt"
+        ).input_features
+        yield AudioChunk(
+            start_ms=offset * 1000 // sampling_rate,
+            end_ms=end * 1000 // sampling_rate,
+            input_features=features,  # type: ignore
+        )
+
+    buffer = np.empty(0, dtype=np.float32)
+    offset = 0
+    for block in stream_audio(path, sampling_rate):
+        buffer = np.concatenate([buffer, block])
+        while len(buffer) >= chunk_len:
+            yield from make_chunk(offset, buffer[:chunk_len])
+            buffer = buffer[step:]
+            offset += step
+
+    # The last chunk only adds new audio if it extends past the overlap
+    # with the previous chunk.
+    if len(buffer) > (stride if offset > 0 else 0):
+        yield from make_chunk(offset, buffer)
+
+
+@dataclass
+class AsrResult:
+    """
+    Columnar transcription results, one entry per audio chunk.
+    """
+
+    start_ms: np.ndarray
+    end_ms: np.ndarray
+    en_prob: np.ndarray
+    es_prob: np.ndarray
+    en_text: List[str]
+    es_text: List[str]
+
+    def __len__(self) -> int:
+        return len(self.en_text)
+
+    def __getitem__(self, idx: slice) -> "AsrResult":
+        return AsrResult(
+            start_ms=self.start_ms[idx],
+            end_ms=self.end_ms[idx],
+            en_prob=self.en_prob[idx],
+            es_prob=self.es_prob[idx],
+            en_text=self.en_text[idx],
+            es_text=self.es_text[idx],
+        )
+
+    @classmethod
+    def concatenate(cls, results: Sequence["AsrResult"]) -> "AsrResult":
+        return cls(
+            start_ms=np.concatenate(
+                [r.start_ms for r in results] or [np.empty(0, np.int64)]
+            ),
+            end_ms=np.concatenate(
+                [r.end_ms for r in results] or [np.empty(0, np.int64)]
+            ),
+            en_prob=np.concatenate(
+                [r.en_prob for r in results] or [np.empty(0, np.float32)]
+            ),
+            es_prob=np.concatenate(
+                [r.es_prob for r in results] or [np.empty(0, np.float32)]
+            ),
+            en_text=[t for r in results for t in r.en_text],
+            es_text=[t for r in results for t in r.es_text],
+        )
+
 
-    model: WhisperForConditionalGeneration = pipe.model  # type: ignore
-    tokenizer: WhisperTokenizer = pipe.tokenizer  # type: ignore
-    language_tokens = ["<|en|>", "<|es|>"]
-    language_token_ids: List[str] = tokenizer.convert_tokens_to_ids(language_tokens)  # type: ignore
-    en_ids = tokenizer.get_decoder_prompt_ids(task="transcribe")
-    es_ids = tokenizer.get_decoder_prompt_ids(language="spanish", task="transcribe")
-    transcribe_token: int = tokenizer.convert_tokens_to_ids("<|transcribe|>")  # type: ignore
+class AsrEngine:
+    """
+    Long-lived Whisper transcriber.
 
-    chunks = pipe.preprocess(str(path), **pipe._preprocess_params)
+    The model is loaded once and reused for every file passed to `transcribe`.
+    Chunks from consecutive files are packed into fixed-size batches so the
+    model stays saturated, and each file's results are yielded as soon as its
+    last chunk has been transcribed. Audio is decoded and chunked as a stream,
+    so memory use does not grow with the length of a file.
 
-    result = []
-    for chunk in chunks:
-        input_features: torch.Tensor = chunk["input_features"].to(device)  # type: ignore
+    Passing a `vad` skips chunks without speech. `stats` keeps a running
+    count of how much audio was skipped, how many decodes were pruned and
+    how many chunks came from the cache.
+
+    With a `prune_threshold`, a chunk is only decoded in the language whose
+    probability reaches the threshold; chunks where neither language does
+    are decoded in both. The text for a pruned decode is left empty.
+
+    With a `cache`, results are stored per chunk under a hash of the chunk's
+    input features, and chunks seen before skip the model entirely.
+
+    `backend` is one of `models.ASR_BACKENDS`; "int8" runs a dynamically
+    quantized model on the CPU.
+    """
+
+    def __init__(
+        self,
+        model_name: str = "openai/whisper-small",
+        batch_size: int = 8,
+        chunk_length_s: int = 15,
+        reuse_encoder: bool = True,
+        vad: Optional[EnergyVad] = None,
+        prune_threshold: Optional[float] = None,
+        cache: Optional[InferenceCache] = None,
+        backend: str = "torch",
+        stats: Optional[AsrStats] = None,
+    ):
+        if prune_threshold is not None and not 0.5 < prune_threshold <= 1.0:
+            raise ValueError("prune_threshold must be in (0.5, 1.0]")
+        self.device = backend_device(backend)
+        self.backend = backend
+        self.vad = vad
+        self.prune_threshold = prune_threshold
+        self.cache = cache
+        self.model_name = model_name
+        self.stats = stats or AsrStats()
+        self.batch_size = batch_size
+        self.chunk_length_s = chunk_length_s
+        self.reuse_encoder = reuse_encoder
+        self.pipe = load_asr_pipeline(model_name, self.device, backend)
+
+        self.model: WhisperForConditionalGeneration = self.pipe.model  # type: ignore
+        self.tokenizer: WhisperTokenizer = self.pipe.tokenizer  # type: ignore
+        self.feature_extractor: WhisperFeatureExtractor = self.pipe.feature_extractor  # type: ignore
+        self.language_tokens = ["<|en|>", "<|es|>"]
+        self.language_token_ids: List[int] = self.tokenizer.convert_tokens_to_ids(self.language_tokens)  # type: ignore
+        self.en_ids = self.tokenizer.get_decoder_prompt_ids(task="transcribe")
+        self.es_ids = self.tokenizer.get_decoder_prompt_ids(
+            language="spanish", task="transcribe"
+        )
+        self.transcribe_token: int = self.tokenizer.convert_tokens_to_ids("<|transcribe|>")  # type: ignore
+
+    def chunks(self, path: Path) -> Iterator[AudioChunk]:
+        return stream_chunks(
+            path,
+            self.feature_extractor,
+            self.chunk_length_s,
+            vad=self.vad,
+            stats=self.stats,
+        )
+
+    def transcribe(self, paths: Iterable[Path]) -> Iterator[Tuple[Path, AsrResult]]:
+        paths = list(paths)
+        results: Dict[int, List[AsrResult]] = {}
+        outstanding: Dict[int, int] = {}
+        batch: List[Tuple[int, AudioChunk]] = []
+        next_to_yield = 0
+
+        def flush():
+            owners = [file_idx for file_idx, _ in batch]
+            batch_result = self.transcribe_batch([c for _, c in batch])
+            batch.clear()
+            start = 0
+            for file_idx, group in groupby(owners):
+                end = start + len(list(group))
+                results[file_idx].append(batch_result[start:end])
+                outstanding[file_idx] -= end - start
+                start = end
+
+        def finished():
+            # Files are fed to the batches in order, so they also finish in order.
+            nonlocal next_to_yield
+            while (
+                next_to_yield < len(paths)
+                and next_to_yield in outstanding
+                and outstanding[next_to_yield] == 0
+            ):
+                yield paths[next_to_yield], AsrResult.concatenate(
+                    results.pop(next_to_yield)
+                )
+                del outstanding[next_to_yield]
+                next_to_yield += 1
+
+        for file_idx, path in enumerate(paths):
+            results[file_idx] = []
+            # Hold the file open (count > 0) until all of its chunks are queued.
+            outstanding[file_idx] = 1
+            for chunk in self.chunks(path):
+                outstanding[file_idx] += 1
+                batch.append((file_idx, chunk))
+                if len(batch) == self.batch_size:
+                    flush()
+                    yield from finished()
+            outstanding[file_idx] -= 1
+            yield from finished()
+
+        if batch:
+            flush()
+        yield from finished()
+
+    def cache_key(self, chunk: AudioChunk) -> str:
+        return InferenceCache.key(
+            "asr",
+            self.model_name,
+            model_revision(self.model.config),
+            self.backend,
+            repr(self.prune_threshold),
+            chunk.input_features.numpy().tobytes(),
+        )
+
+    def transcribe_batch(self, chunks: List[AudioChunk]) -> AsrResult:
+        if self.cache is None:
+            return self.infer(chunks)
+
+        keys = [self.cache_key(c) for c in chunks]
+        cached = self.cache.get_many(set(keys))
+        todo = [i for i, key in enumerate(keys) if key not in cached]
+        self.stats.cached_chunks += len(chunks) - len(todo)
+        if todo:
+            result = self.infer([chunks[i] for i in todo])
+            fresh = {
+                keys[i]: (
+                    result.en_prob[j],
+                    result.es_prob[j],
+                    result.en_text[j],
+                    result.es_text[j],
+                )
+                for j, i in enumerate(todo)
+            }
+            self.cache.put_many(fresh)
+            cached.update(fresh)
+
+        en_prob, es_prob, en_text, es_text = zip(*(cached[key] for key in keys))
+        return AsrResult(
+            start_ms=np.array([c.start_ms for c in chunks], dtype=np.int64),
+            end_ms=np.array([c.end_ms for c in chunks], dtype=np.int64),
+            en_prob=np.array(en_prob, dtype=np.float32),
+            es_prob=np.array(es_prob, dtype=np.float32),
+            en_text=list(en_text),
+            es_text=list(es_text),
+        )
+
+    def infer(self, chunks: List[AudioChunk]) -> AsrResult:
+        model = self.model
+        input_features = torch.cat([c.input_features for c in chunks]).to(self.device)
+        if self.reuse_encoder:
+            # Encode the chunk once and share the encoder output between the
+            # language probability pass and both forced-language decodes.
+            with torch.no_grad():
+                inputs = {"encoder_outputs": model.get_encoder()(input_features)}
+        else:
+            inputs = {"input_features": input_features}
         logits = model(
-            input_features,
+            **inputs,
             decoder_input_ids=torch.full(
                 (input_features.shape[0], 1),
-                transcribe_token,
-                device=device,
+                self.transcribe_token,
+                device=self.device,
             ),
         ).logits.detach()
-        en_tokens = model.generate(
-            input_features,
-            forced_decoder_ids=en_ids,
-            repetition_penalty=1.1,
+
+        mask = torch.ones(logits.shape[-1], dtype=torch.bool, device=self.device)
+        mask[self.language_token_ids] = False
+        logits[:, :, mask] = -float("inf")
+
+        output_probs = logits[:, 0].softmax(dim=-1)[:, self.language_token_ids]
+        output_probs = output_probs.float().cpu().numpy()
+        en_prob = output_probs[:, 0]
+        es_prob = output_probs[:, 1]
+
+        n_chunks = len(chunks)
+        if self.prune_threshold is None:
+            decode_en = decode_es = np.ones(n_chunks, dtype=bool)
+        else:
+            decode_en = es_prob < self.prune_threshold
+            decode_es = en_prob < self.prune_threshold
+        self.stats.decoded_chunks += n_chunks
+        self.stats.pruned_decodes += int((~decode_en).sum() + (~decode_es).sum())
+
+        en_text = self.decode(inputs, decode_en, self.en_ids)
+        es_text = self.decode(inputs, decode_es, self.es_ids)
+
+        return AsrResult(
+            start_ms=np.array([c.start_ms for c in chunks], dtype=np.int64),
+            end_ms=np.array([c.end_ms for c in chunks], dtype=np.int64),
+            en_prob=en_prob,
+            es_prob=es_prob,
+            en_text=en_text,
+            es_text=es_text,
         )
 
-        es_tokens = model.generate(
-            input_features,
-            forced_decoder_ids=es_ids,
+    def decode(
+        self, inputs: dict, selected: np.ndarray, forced_decoder_ids
+    ) -> List[str]:
+        """
+        Decode the `selected` rows of a batch, leaving the others empty.
+        """
+        text = [""] * len(selected)
+        if not selected.any():
+            return text
+        if not selected.all():
+            idx = torch.from_numpy(np.flatnonzero(selected)).to(self.device)
+            if "encoder_outputs" in inputs:
+                hidden = inputs["encoder_outputs"].last_hidden_state[idx]
+                inputs = {"encoder_outputs": BaseModelOutput(last_hidden_state=hidden)}
+            else:
+                inputs = {"input_features": inputs["input_features"][idx]}
+        tokens = self.model.generate(
+            **inputs,
+            forced_decoder_ids=forced_decoder_ids,
             repetition_penalty=1.1,
         )
+        decoded = self.tokenizer.batch_decode(tokens, skip_special_tokens=False)
+        for i, t in zip(np.flatnonzero(selected), decoded):
+            text[i] = t
+        return text
 
-        mask = torch.ones(logits.shape[-1], dtype=torch.bool, device=device)
-        mask[language_token_ids] = False
-        logits[:, :, mask] = -float("inf")
-
-        output_probs = logits.softmax(dim=-1).cpu()
 
-        for input_idx in range(logits.shape[0]):
-            r = {
-                lang: output_probs[input_idx, 0, token_id].item()
-                for token_id, lang in zip(language_token_ids, language_tokens)
-            }
-            r["en_text"] = tokenizer.batch_decode(en_tokens, skip_special_tokens=False)
-            r["es_text"] = tokenizer.batch_decode(es_tokens, skip_special_tokens=False)
-            result.append(r)
+def run_asr(
+    path: Path,
+    model_name: str = "openai/whisper-small",
+    reuse_encoder: bool = True,
+    vad: Optional[EnergyVad] = None,
+    prune_threshold: Optional[float] = None,
+    cache: Optional[InferenceCache] = None,
+    backend: str = "torch",
+    stats: Optional[AsrStats] = None,
+) -> AsrResult:
+    """
+    Transcribe a single file. Pass `stats` to get counts of skipped audio
+    and pruned decodes.
+    """
+    engine = AsrEngine(
+        model_name,
+        reuse_encoder=reuse_encoder,
+        vad=vad,
+        prune_threshold=prune_threshold,
+        cache=cache,
+        backend=backend,
+        stats=stats,
+    )
+    _, result = next(engine.transcribe([path]))
     return result
 
     # return pipe(str(path), batch_size=8, return_timestamps=True)
 
 
-# %%
-result = run_asr(
-    Path(
-        "/Users/logan/Projects/code-switching/data/audio/que-pasa-midwest/que-pasa-midwest_1_1_pulque-en-america.mp3"
+special_token_re = re.compile(r"<\|.*?\|>")
+
+
+def normalize_word(word: str) -> str:
+    return word.strip(string.punctuation + "¿¡").lower()
+
+
+def overlap_words(
+    previous: List[str], following: List[str], max_words: int = 50
+) -> int:
+    """
+    Number of words at the start of `following` that transcribe the same
+    audio as the end of `previous`.
+
+    Like `transformers` does when merging chunked transcripts, this picks
+    the alignment of the two word sequences with the most matching words.
+    At least two and at least half of the aligned words must match, since
+    words cut off at a chunk's edge are often transcribed differently.
+    """
+    tail = [normalize_word(w) for w in previous[-max_words:]]
+    head = [normalize_word(w) for w in following[:max_words]]
+    best, best_matches = 0, 1
+    for n in range(1, min(len(tail), len(head)) + 1):
+        matches = sum(a == b for a, b in zip(tail[-n:], head[:n]))
+        if matches > best_matches and 2 * matches >= n:
+            best, best_matches = n, matches
+    return best
+
+
+def merge_overlaps(
+    start_ms: List[int], end_ms: List[int], texts: List[List[str]]
+) -> List[List[str]]:
+    """
+    Split the overlap between consecutive chunks down the middle.
+
+    Chunks overlap by twice the stride, so every overlapping pair of chunks
+    transcribes the overlap twice. `start_ms` and `end_ms` are moved in
+    place to the middle of the overlap, which is where the chunks' un-strided
+    spans meet. For every column of `texts` (one string per chunk), the
+    repeated words are found with `overlap_words` and split the same way.
+    Chunks dropped by a VAD leave gaps, which are left alone.
+    """
+    words = [[text.split() for text in column] for column in texts]
+    for i in range(1, len(start_ms)):
+        if start_ms[i] >= end_ms[i - 1]:
+            continue
+        middle = (start_ms[i] + end_ms[i - 1]) // 2
+        end_ms[i - 1] = start_ms[i] = middle
+        for column in words:
+            n = overlap_words(column[i - 1], column[i])
+            column[i - 1] = column[i - 1][: len(column[i - 1]) - n // 2]
+            column[i] = column[i][n - n // 2 :]
+    return [[" ".join(w) for w in column] for column in words]
+
+
+def write_csv(result: AsrResult, path: Path):
+    """
+    Write results in the whisper-cpp CSV layout (`start,end,text` in ms) read
+    by `script/annotate.py`, plus the per-language probabilities and texts.
+    The `text` column holds the transcript in the more likely language.
+    Overlapping chunks are merged with `merge_overlaps`, so rows don't
+    overlap and the overlaps aren't transcribed twice.
+    """
+    start_ms = [int(t) for t in result.start_ms]
+    end_ms = [int(t) for t in result.end_ms]
+    en_prob = [float(p) for p in result.en_prob]
+    es_prob = [float(p) for p in result.es_prob]
+    en_text = [special_token_re.sub("", t).strip() for t in result.en_text]
+    es_text = [special_token_re.sub("", t).strip() for t in result.es_text]
+    text = [
+        en if pe >= ps else es
+        for en, es, pe, ps in zip(en_text, es_text, en_prob, es_prob)
+    ]
+    text, en_text, es_text = merge_overlaps(start_ms, end_ms, [text, en_text, es_text])
+
+    with path.open("w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(
+            ["start", "end", "text", "en_prob", "es_prob", "en_text", "es_text"]
+        )
+        writer.writerows(
+            zip(start_ms, end_ms, text, en_prob, es_prob, en_text, es_text)
+        )
+
+
+if __name__ == "__main__":
+    # %%
+    stats = AsrStats()
+    result = run_asr(
+        Path(
+            "/Users/logan/Projects/code-switching/data/audio/que-pasa-midwest/que-pasa-midwest_1_1_pulque-en-america.mp3"
+        ),
+        stats=stats,
     )
-)
+    print(stats.report())
 
-# Load data
-# Split into 30s chunks
-# Token-level language ID: https://discuss.huggingface.co/t/language-detection-with-whisper/26003/2
-result
+    # Load data
+    # Split into 30s chunks
+    # Token-level language ID: https://discuss.huggingface.co/t/language-detection-with-whisper/26003/2
+    result
@@ -0,0 +1,210 @@
+import hashlib
+import pickle
+import threading
+import time
+from itertools import islice
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Union
+
+from sqlalchemy import (
+    Column,
+    Float,
+    Integer,
+    LargeBinary,
+    MetaData,
+    String,
+    Table,
+    bindparam,
+    create_engine,
+    delete,
+    event,
+    func,
+    select,
+    update,
+)
+
+if TYPE_CHECKING:
+    from transformers import PretrainedConfig
+
+metadata = MetaData()
+
+cache_entries = Table(
+    "CacheEntries",
+    metadata,
+    Column("key", String, primary_key=True),
+    Column("value", LargeBinary),
+    Column("size", Integer),
+    Column("last_used", Float, index=True),
+)
+
+# A single row holding the total size of all entries
+cache_size = Table(
+    "CacheSize",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("total_bytes", Integer),
+)
+
+
+def model_revision(config: "PretrainedConfig") -> str:
+    """
+    Identify the exact weights a model was loaded with: the Hub commit hash
+    when there is one, or else its name or local path.
+    """
+    return getattr(config, "_commit_hash", None) or config.name_or_path
+
+
+def set_pragmas(dbapi_connection, connection_record):
+    # Several worker processes may share one cache
+    dbapi_connection.execute("PRAGMA journal_mode=WAL")
+    dbapi_connection.execute("PRAGMA synchronous=NORMAL")
+
+
+class InferenceCache:
+    """
+    Size-bounded, on-disk cache of model outputs keyed by content hash.
+
+    Keys are built with `key` from everything that determines an output:
+    the model name and revision, any settings, and the exact input. Values
+    are pickled into a SQLite DB. Hits refresh an entry's last use, and once
+    the cache grows past `max_bytes` the least recently used entries are
+    evicted.
+
+    Lookups only read, so processes sharing a cache don't wait on each
+    other for hits. The refreshed last uses are written with the next
+    `put_many`, or after `touch_interval_s` seconds at the latest. The
+    total size is kept up to date in `CacheSize`, so neither writing nor
+    evicting scans the whole cache.
+    """
+
+    def __init__(
+        self, path: Path, max_bytes: int = 4 * 2**30, touch_interval_s: float = 60
+    ):
+        self.max_bytes = max_bytes
+        self.touch_interval_s = touch_interval_s
+        self.touched: Dict[str, float] = {}
+        self.touch_lock = threading.Lock()
+        self.last_touch = time.time()
+        self.engine = create_engine(f"sqlite:///{path}", connect_args={"timeout": 60})
+        event.listen(self.engine, "connect", set_pragmas)
+        metadata.create_all(self.engine)
+        with self.engine.begin() as connection:
+            # Caches created before `CacheSize` existed are summed once
+            connection.execute(
+                cache_size.insert()
+                .prefix_with("OR IGNORE")
+                .from_select(
+                    ["id", "total_bytes"],
+                    select(1, func.coalesce(func.sum(cache_entries.c.size), 0)),
+                )
+            )
+
+    @staticmethod
+    def key(*parts: Union[str, bytes]) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            data = part.encode() if isinstance(part, str) else part
+            # Length prefixes keep ("ab", "c") and ("a", "bc") apart
+            digest.update(len(data).to_bytes(8, "little"))
+            digest.update(data)
+        return digest.hexdigest()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        found = {}
+        now = time.time()
+        keys = iter(keys)
+        with self.engine.connect() as connection:
+            # Stay below SQLite's limit on bound parameters
+            while batch := list(islice(keys, 500)):
+                rows = connection.execute(
+                    select(cache_entries.c.key, cache_entries.c.value).where(
+                        cache_entries.c.key.in_(batch)
+                    )
+                )
+                found.update({key: pickle.loads(value) for key, value in rows})
+        with self.touch_lock:
+            self.touched.update(dict.fromkeys(found, now))
+        if now - self.last_touch > self.touch_interval_s:
+            with self.engine.begin() as connection:
+                self.touch(connection)
+        return found
+
+    def touch(self, connection):
+        """
+        Write the last uses of the entries hit since the last call.
+        """
+        # Lookups and writes may come from different threads
+        with self.touch_lock:
+            touched, self.touched = self.touched, {}
+            self.last_touch = time.time()
+        if touched:
+            connection.execute(
+                update(cache_entries)
+                .where(cache_entries.c.key == bindparam("entry_key"))
+                .values(last_used=bindparam("last_used")),
+                [
+                    {"entry_key": key, "last_used": last_used}
+                    for key, last_used in touched.items()
+                ],
+            )
+
+    def put_many(self, entries: Dict[str, Any]):
+        if not entries:
+            return
+        now = time.time()
+        rows = []
+        for key, value in entries.items():
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            rows.append(
+                {"key": key, "value": data, "size": len(data), "last_used": now}
+            )
+        with self.engine.begin() as connection:
+            # Write first, so the transaction holds the write lock before it
+            # reads anything
+            connection.execute(
+                update(cache_size).values(
+                    total_bytes=cache_size.c.total_bytes + sum(r["size"] for r in rows)
+                )
+            )
+            self.touch(connection)
+            keys = iter(entries)
+            while batch := list(islice(keys, 500)):
+                # Entries being replaced no longer count
+                replaced = connection.scalar(
+                    select(func.sum(cache_entries.c.size)).where(
+                        cache_entries.c.key.in_(batch)
+                    )
+                )
+                if replaced:
+                    connection.execute(
+                        update(cache_size).values(
+                            total_bytes=cache_size.c.total_bytes - replaced
+                        )
+                    )
+            connection.execute(cache_entries.insert().prefix_with("OR REPLACE"), rows)
+            self.evict(connection)
+
+    def evict(self, connection, chunk_size: int = 500):
+        total = connection.scalar(select(cache_size.c.total_bytes)) or 0
+        if total <= self.max_bytes:
+            return
+        # Walk the entries from least recently used, along the `last_used`
+        # index, until enough are dropped to fit in `max_bytes`
+        while total > self.max_bytes:
+            rows = connection.execute(
+                select(cache_entries.c.key, cache_entries.c.size)
+                .order_by(cache_entries.c.last_used)
+                .limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+            evicted = []
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                evicted.append(key)
+                total -= size
+            connection.execute(
+                delete(cache_entries).where(cache_entries.c.key.in_(evicted))
+            )
+        connection.execute(update(cache_size).values(total_bytes=max(total, 0)))
@@ -0,0 +1,124 @@
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+from sqlalchemy import Engine
+
+# Columns exported per table, with their dtypes. String columns are stored
+# as int32 codes into a corpus-wide dictionary of the same name.
+columns = {
+    "segments": {
+        "id": np.int64,
+        "start_ms": np.int64,
+        "end_ms": np.int64,
+    },
+    "words": {
+        "id": np.int64,
+        "segment_id": np.int64,
+        "word_index": np.int32,
+        "surface_form": str,
+    },
+    "word_annotations": {
+        "id": np.int64,
+        "word_id": np.int64,
+        "annotation_type_id": np.int32,
+        "value": str,
+        "confidence": np.float32,
+    },
+}
+
+queries = {
+    "segments": """
+        SELECT id, start_ms, end_ms FROM Segments
+        WHERE data_source_id = ? ORDER BY id
+    """,
+    "words": """
+        SELECT w.id, w.segment_id, w.word_index, w.surface_form
+        FROM Words AS w JOIN Segments AS s ON w.segment_id = s.id
+        WHERE s.data_source_id = ? ORDER BY w.id
+    """,
+    "word_annotations": """
+        SELECT a.id, a.word_id, a.annotation_type_id, a.value, a.confidence
+        FROM WordAnnotations AS a
+        JOIN Words AS w ON a.word_id = w.id
+        JOIN Segments AS s ON w.segment_id = s.id
+        WHERE s.data_source_id = ? ORDER BY a.id
+    """,
+}
+
+dictionary_queries = {
+    "surface_form": "SELECT DISTINCT surface_form FROM Words",
+    "value": "SELECT DISTINCT value FROM WordAnnotations",
+}
+
+
+def partition_path(root: Path, data_source_id: int) -> Path:
+    return root / f"data_source_id={data_source_id}"
+
+
+def export_columns(engine: Engine, root: Path):
+    """
+    Write `Segments`, `Words` and `WordAnnotations` as one `.npy` file per
+    column, partitioned into a directory per data source.
+
+    String columns are dictionary encoded: `dictionaries/<column>.npy` holds
+    the sorted distinct values and the column holds indices into it. All
+    files are plain NumPy arrays, so `ColumnarCorpus` can memory-map them.
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    (root / "dictionaries").mkdir(exist_ok=True)
+    with engine.connect() as connection:
+        dictionaries = {}
+        for name, query in dictionary_queries.items():
+            # Sorted by NumPy's string order, for `searchsorted`
+            dictionaries[name] = np.unique(
+                np.array(connection.exec_driver_sql(query).scalars().all(), dtype=str)
+            )
+            np.save(root / "dictionaries" / f"{name}.npy", dictionaries[name])
+
+        data_source_ids = connection.exec_driver_sql(
+            "SELECT DISTINCT data_source_id FROM Segments ORDER BY data_source_id"
+        )
+        for data_source_id in data_source_ids.scalars().all():
+            partition = partition_path(root, data_source_id)
+            for table, dtypes in columns.items():
+                (partition / table).mkdir(parents=True, exist_ok=True)
+                rows = connection.exec_driver_sql(
+                    queries[table], (data_source_id,)
+                ).fetchall()
+                values = zip(*rows) if rows else ([] for _ in dtypes)
+                for (name, dtype), column in zip(dtypes.items(), values):
+                    if dtype is str:
+                        array = np.searchsorted(
+                            dictionaries[name], np.array(column, dtype=str)
+                        ).astype(np.int32)
+                    else:
+                        array = np.array(column, dtype=dtype)
+                    np.save(partition / table / f"{name}.npy", array)
+
+
+class ColumnarCorpus:
+    """
+    Reader for a corpus written by `export_columns`.
+
+    Arrays are memory-mapped rather than read, so loading is instant and
+    only the pages that a computation touches are read from disk.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def data_source_ids(self) -> List[int]:
+        return sorted(
+            int(p.name.split("=", 1)[1]) for p in self.root.glob("data_source_id=*")
+        )
+
+    def dictionary(self, name: str) -> np.ndarray:
+        return np.load(self.root / "dictionaries" / f"{name}.npy", mmap_mode="r")
+
+    def table(self, data_source_id: int, table: str) -> Dict[str, np.ndarray]:
+        directory = partition_path(self.root, data_source_id) / table
+        return {
+            name: np.load(directory / f"{name}.npy", mmap_mode="r")
+            for name in columns[table]
+        }
@@ -0,0 +1,313 @@
+import csv
+import multiprocessing
+import os
+import queue
+import re
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+import typer
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .annotation import (
+    LID_PRETRAINED,
+    POS_PRETRAINED,
+    AnnotationLabels,
+    FusedAnnotator,
+    TokenPredictions,
+    WordPredictions,
+)
+from .cache import InferenceCache
+from .ingest import (
+    AnnotationContext,
+    BulkWriter,
+    IdManagers,
+    get_checkpoint,
+    read_segments,
+    write_annotations,
+)
+from .models import BACKENDS, configure_torch_threads, process_context
+from .schema import (
+    AnnotationCheckpoint,
+    DataSource,
+    bulk_load,
+    create_db_engine,
+    open_db,
+)
+
+
+class TranscriptJob(NamedTuple):
+    path: Path
+    source_name: str
+    start_row: int
+
+
+def normalize_name(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def find_transcripts(paths: List[Path]) -> List[Tuple[Path, Optional[str]]]:
+    """
+    Collect transcript CSVs from directories, single files and manifests.
+
+    A manifest is a TSV file with `path` and `source` columns; relative paths
+    are resolved against the manifest's directory. Transcripts found any
+    other way have no source yet.
+    """
+    transcripts: List[Tuple[Path, Optional[str]]] = []
+    for path in paths:
+        if path.is_dir():
+            transcripts.extend((p, None) for p in sorted(path.rglob("*.csv")))
+        elif path.suffix == ".tsv":
+            with path.open("r") as f:
+                for row in csv.DictReader(f, delimiter="\t"):
+                    transcripts.append((path.parent / row["path"], row["source"]))
+        else:
+            transcripts.append((path, None))
+    return transcripts
+
+
+def resolve_sources(
+    transcripts: List[Tuple[Path, Optional[str]]],
+    source_names: List[str],
+    default_source: Optional[str] = None,
+) -> List[Tuple[Path, str]]:
+    """
+    Pick the data source of every transcript.
+
+    Transcripts without an explicit source use `default_source`, or else the
+    data source whose name matches their directory name, ignoring case,
+    spaces and punctuation.
+    """
+    by_normalized = {normalize_name(name): name for name in source_names}
+    resolved = []
+    for path, source_name in transcripts:
+        if source_name is None:
+            source_name = default_source or by_normalized.get(
+                normalize_name(path.parent.name)
+            )
+        if source_name not in source_names:
+            raise ValueError(f"No data source found for {path}")
+        resolved.append((path, source_name))
+    return resolved
+
+
+_annotator: Optional[FusedAnnotator] = None
+
+
+def _init_worker(
+    lid_pretrained: str,
+    pos_pretrained: str,
+    batch_size: int,
+    threads: int,
+    cache: Optional[Path],
+    lid_backend: str,
+    pos_backend: str,
+):
+    global _annotator
+    # Workers run one batch at a time, so parallel ops would only compete
+    # with the other workers for cores
+    configure_torch_threads(threads, interop_threads=1)
+    _annotator = FusedAnnotator(
+        lid_pretrained,
+        pos_pretrained,
+        batch_size,
+        cache=InferenceCache(cache) if cache is not None else None,
+        lid_backend=lid_backend,
+        pos_backend=pos_backend,
+    )
+
+
+def _annotate(texts: List[str]) -> Tuple[TokenPredictions, WordPredictions]:
+    assert _annotator is not None
+    predictions = _annotator.annotate(texts)
+    return predictions, _annotator.aggregate(predictions)
+
+
+class SourceStats:
+    def __init__(self, started: float):
+        self.started = started
+        self.transcripts = 0
+        self.segments = 0
+        self.tokens = 0
+
+    def report(self) -> str:
+        elapsed = time.perf_counter() - self.started
+        return (
+            f"{self.transcripts} transcripts, {self.segments} segments, "
+            f"{self.tokens} tokens in {elapsed:.1f}s "
+            f"({self.tokens / max(elapsed, 1e-9):.0f} tokens/s)"
+        )
+
+
+def _write(db: Path, model_name: str, messages: "multiprocessing.Queue[tuple]"):
+    """
+    Writer process: the only process that writes to the DB.
+
+    Receives `("batch", path, source_name, segments, predictions, words)` and
+    `("done", path, source_name)` messages until it receives `None`. Every
+    batch is committed together with its transcript's checkpoint.
+    """
+    engine = create_db_engine(db)
+    labels = AnnotationLabels.from_pretrained(LID_PRETRAINED, POS_PRETRAINED)
+    ids = IdManagers(engine)
+    contexts: Dict[str, AnnotationContext] = {}
+    started = time.perf_counter()
+    sources: Dict[str, SourceStats] = {}
+
+    with bulk_load(engine), Session(engine) as session:
+        while (message := messages.get()) is not None:
+            kind, path, source_name, *payload = message
+            if source_name not in contexts:
+                contexts[source_name] = AnnotationContext.fetch(
+                    session, source_name, model_name, LID_PRETRAINED, POS_PRETRAINED
+                )
+            context = contexts[source_name]
+            checkpoint = get_checkpoint(session, context.data_source_id, path.name)
+            stats = sources.setdefault(source_name, SourceStats(started))
+
+            if kind == "batch":
+                segments, predictions, words = payload
+                write_annotations(
+                    BulkWriter(session.connection()),
+                    ids,
+                    labels,
+                    context,
+                    segments,
+                    predictions,
+                    words,
+                )
+                checkpoint.rows_done = segments[-1].next_row
+                session.commit()
+                stats.segments += len(segments)
+                stats.tokens += len(predictions.tokens)
+            else:
+                checkpoint.finished = True
+                session.commit()
+                stats.transcripts += 1
+                typer.echo(f"{source_name}: finished {path.name}; {stats.report()}")
+
+    for source_name, stats in sources.items():
+        typer.echo(f"{source_name}: {stats.report()}")
+
+
+def _send(messages: "multiprocessing.Queue[tuple]", writer, message: Optional[tuple]):
+    # The queue is bounded, so don't wait forever on a writer that has died
+    while True:
+        try:
+            messages.put(message, timeout=1)
+            return
+        except queue.Full:
+            if not writer.is_alive():
+                raise RuntimeError("Writer process exited early")
+
+
+def main(
+    paths: List[Path],
+    db: Path = typer.Option(...),
+    model_name: str = "whisper-small",
+    source_name: Optional[str] = None,
+    workers: Optional[int] = None,
+    threads_per_worker: int = 4,
+    batch_size: int = 32,
+    commit_every: int = 500,
+    cache: Optional[Path] = None,
+    lid_backend: str = "torch",
+    pos_backend: str = "torch",
+):
+    for backend in (lid_backend, pos_backend):
+        if backend not in BACKENDS:
+            raise typer.BadParameter(f"Unknown backend {backend!r}")
+    engine = open_db(db)
+
+    with Session(engine) as session:
+        source_ids = dict(session.execute(select(DataSource.name, DataSource.id)).all())
+        checkpoints = {
+            (c.data_source_id, c.transcript): c
+            for c in session.scalars(select(AnnotationCheckpoint))
+        }
+    engine.dispose()
+
+    jobs = []
+    for path, source in resolve_sources(
+        find_transcripts(paths), list(source_ids), source_name
+    ):
+        checkpoint = checkpoints.get((source_ids[source], path.name))
+        if checkpoint is None:
+            jobs.append(TranscriptJob(path, source, 0))
+        elif not checkpoint.finished:
+            jobs.append(TranscriptJob(path, source, checkpoint.rows_done))
+    typer.echo(f"{len(jobs)} transcripts to annotate")
+    if not jobs:
+        return
+
+    cpus = os.cpu_count() or 1
+    if workers is None:
+        workers = max(1, cpus // threads_per_worker)
+    threads = max(1, cpus // workers)
+    typer.echo(f"Annotating with {workers} workers")
+
+    context = process_context()
+    messages = context.Queue(maxsize=2 * workers)
+    writer = context.Process(target=_write, args=(db, model_name, messages))
+    writer.start()
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(
+                LID_PRETRAINED,
+                POS_PRETRAINED,
+                batch_size,
+                threads,
+                cache,
+                lid_backend,
+                pos_backend,
+            ),
+        ) as pool:
+            # Batches are forwarded to the writer in submission order, which
+            # keeps each transcript's checkpoint moving forward monotonically.
+            in_flight: Deque[Tuple[TranscriptJob, list, Optional[Future]]] = deque()
+
+            def forward(limit: int):
+                while len(in_flight) > limit:
+                    job, segments, future = in_flight.popleft()
+                    if future is None:
+                        message = ("done", job.path, job.source_name)
+                    else:
+                        message = ("batch", job.path, job.source_name, segments)
+                        message += future.result()
+                    _send(messages, writer, message)
+
+            try:
+                for job in jobs:
+                    segments = read_segments(job.path, start_row=job.start_row)
+                    while batch := list(islice(segments, commit_every)):
+                        future = pool.submit(_annotate, [s.text for s in batch])
+                        in_flight.append((job, batch, future))
+                        forward(2 * workers)
+                    in_flight.append((job, [], None))
+                forward(0)
+            except BaseException:
+                # Don't annotate batches that will never be written
+                pool.shutdown(cancel_futures=True)
+                raise
+    finally:
+        # Also stop the writer when annotation fails, after it has committed
+        # the batches it already received, rather than leave it waiting
+        if writer.is_alive():
+            _send(messages, writer, None)
+        writer.join()
+    if writer.exitcode != 0:
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
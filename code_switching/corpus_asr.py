@@ -0,0 +1,210 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict
+from pathlib import Path
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
+
+import typer
+
+from .cache import InferenceCache
+from .models import ASR_BACKENDS, process_context
+
+if TYPE_CHECKING:
+    from .asr import AsrEngine
+
+AUDIO_SUFFIXES = {".mp3", ".m4a", ".wav", ".flac", ".ogg"}
+
+
+def file_checksum(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        while block := f.read(1 << 20):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def output_path(audio: Path) -> Path:
+    # Next to the audio, but not where `script/asr.sh` writes its transcript
+    return audio.with_name(f"{audio.stem}.hf-whisper.csv")
+
+
+class Manifest:
+    """
+    Per-file job status for a corpus run, stored as JSON.
+
+    The file is rewritten after every update, so an interrupted run can be
+    restarted and will skip every file that already finished.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.entries: Dict[str, dict] = {}
+        if path.exists():
+            self.entries = json.loads(path.read_text())
+
+    def is_done(self, audio: Path) -> bool:
+        entry = self.entries.get(str(audio))
+        if entry is None or entry["status"] != "done":
+            return False
+        output = Path(entry["output"])
+        return output.exists() and file_checksum(output) == entry["sha256"]
+
+    def owns_output(self, audio: Path) -> bool:
+        """
+        Whether the output file for `audio`, if there is one, was written by
+        a run with this manifest.
+        """
+        return not output_path(audio).exists() or str(audio) in self.entries
+
+    def update(self, audio: Path, **entry):
+        self.entries[str(audio)] = entry
+        tmp_path = self.path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(self.entries, indent=2))
+        tmp_path.replace(self.path)
+
+
+def default_workers(model_memory_gb: float, threads_per_worker: int) -> int:
+    """
+    Number of workers that fits both the CPU count and the available memory.
+    """
+    cpus = os.cpu_count() or 1
+    by_cpu = max(1, cpus // threads_per_worker)
+    try:
+        available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (ValueError, OSError, AttributeError):
+        return by_cpu
+    by_memory = max(1, int(available / (model_memory_gb * 2**30)))
+    return min(by_cpu, by_memory)
+
+
+_engine: Optional["AsrEngine"] = None
+
+
+def _init_worker(
+    model_name: str,
+    batch_size: int,
+    threads: int,
+    vad: bool,
+    vad_reject_music: bool,
+    prune_threshold: Optional[float],
+    cache: Optional[Path],
+    backend: str,
+):
+    import torch
+
+    from .asr import AsrEngine, EnergyVad
+
+    global _engine
+    torch.set_num_threads(threads)
+    _engine = AsrEngine(
+        model_name,
+        batch_size=batch_size,
+        vad=EnergyVad(reject_music=vad_reject_music) if vad else None,
+        prune_threshold=prune_threshold,
+        cache=InferenceCache(cache) if cache is not None else None,
+        backend=backend,
+    )
+
+
+def _transcribe(audio: Path) -> Tuple[dict, str]:
+    from .asr import AsrStats, write_csv
+
+    assert _engine is not None
+    output = output_path(audio)
+    # Count this file only; each worker transcribes one file at a time
+    _engine.stats = AsrStats()
+    _, result = next(_engine.transcribe([audio]))
+    write_csv(result, output)
+    entry = {
+        "status": "done",
+        "output": str(output),
+        "sha256": file_checksum(output),
+        "stats": asdict(_engine.stats),
+    }
+    return entry, _engine.stats.report()
+
+
+def find_audio(paths: List[Path]) -> List[Path]:
+    files = []
+    for path in paths:
+        if path.is_dir():
+            files.extend(
+                sorted(p for p in path.rglob("*") if p.suffix.lower() in AUDIO_SUFFIXES)
+            )
+        else:
+            files.append(path)
+    return files
+
+
+def main(
+    paths: List[Path],
+    model_name: str = "openai/whisper-small",
+    manifest: Optional[Path] = None,
+    workers: Optional[int] = None,
+    threads_per_worker: int = 4,
+    model_memory_gb: float = 2.0,
+    batch_size: int = 8,
+    vad: bool = False,
+    vad_reject_music: bool = False,
+    prune_threshold: Optional[float] = None,
+    cache: Optional[Path] = None,
+    backend: str = "torch",
+):
+    if backend not in ASR_BACKENDS:
+        raise typer.BadParameter(f"Unknown ASR backend {backend!r}")
+    files = find_audio(paths)
+    if manifest is None:
+        root = paths[0] if paths[0].is_dir() else paths[0].parent
+        manifest = root / "asr-manifest.json"
+    jobs = Manifest(manifest)
+
+    todo = [f for f in files if not jobs.is_done(f)]
+    typer.echo(f"{len(files) - len(todo)}/{len(files)} files already transcribed")
+    for audio in todo:
+        if not jobs.owns_output(audio):
+            typer.echo(
+                f"Skipping {audio}: {output_path(audio)} exists and is not in "
+                f"{manifest}",
+                err=True,
+            )
+    todo = [f for f in todo if jobs.owns_output(f)]
+    if not todo:
+        return
+
+    if workers is None:
+        workers = default_workers(model_memory_gb, threads_per_worker)
+    workers = min(workers, len(todo))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    typer.echo(f"Transcribing {len(todo)} files with {workers} workers")
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=process_context(),
+        initializer=_init_worker,
+        initargs=(
+            model_name,
+            batch_size,
+            threads,
+            vad,
+            vad_reject_music,
+            prune_threshold,
+            cache,
+            backend,
+        ),
+    ) as pool:
+        futures = {pool.submit(_transcribe, f): f for f in todo}
+        for future in as_completed(futures):
+            audio = futures[future]
+            try:
+                entry, report = future.result()
+                jobs.update(audio, **entry)
+                typer.echo(f"Done: {audio}: {report}")
+            except Exception as e:
+                jobs.update(audio, status="failed", error=repr(e))
+                typer.echo(f"Failed: {audio}: {e!r}", err=True)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,156 @@
+import os
+import stat
+from pathlib import Path
+
+from sqlalchemy import (
+    Column,
+    ForeignKey,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    create_engine,
+)
+from sqlalchemy.schema import CreateTable
+
+# Only what the UI queries: no tokens, no token annotations and no
+# confidences. Annotation values are stored once in `AnnotationValues` and
+# referenced by id; the `WordAnnotations` view decodes them again so the
+# UI's queries work unchanged.
+ui_metadata = MetaData()
+
+ui_data_sources = Table(
+    "DataSources",
+    ui_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String),
+    Column("url", String),
+    Column("creator", String),
+)
+
+ui_annotation_types = Table(
+    "AnnotationTypes",
+    ui_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String),
+)
+
+ui_annotation_values = Table(
+    "AnnotationValues",
+    ui_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("value", String, unique=True),
+)
+
+ui_segments = Table(
+    "Segments",
+    ui_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("start_ms", Integer),
+    Column("end_ms", Integer),
+    Column("data_source_id", Integer, ForeignKey("DataSources.id")),
+    Index("ix_segments_source", "data_source_id", "start_ms"),
+)
+
+ui_words = Table(
+    "Words",
+    ui_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("surface_form", String),
+    Column("segment_id", Integer, ForeignKey("Segments.id")),
+    Column("word_index", Integer),
+    Index("ix_words_segment", "segment_id", "word_index"),
+)
+
+ui_word_annotation_codes = Table(
+    "WordAnnotationCodes",
+    ui_metadata,
+    Column("id", Integer, primary_key=True),
+    Column("word_id", Integer, ForeignKey("Words.id")),
+    Column("annotation_type_id", Integer, ForeignKey("AnnotationTypes.id")),
+    Column("value_id", Integer, ForeignKey("AnnotationValues.id")),
+    Index("ix_word_annotations_word", "word_id", "annotation_type_id", "value_id"),
+    Index("ix_word_annotations_type", "annotation_type_id", "word_id"),
+)
+
+ui_views = {
+    "WordAnnotations": """
+        SELECT a.id, v.value, a.word_id, a.annotation_type_id
+        FROM WordAnnotationCodes AS a
+        JOIN AnnotationValues AS v ON a.value_id = v.id
+    """,
+}
+
+
+def export_ui_db(source: Path, target: Path, page_size: int = 1024):
+    """
+    Write the parts of the corpus DB at `source` that the UI uses to a new,
+    read-only DB at `target`.
+
+    Rows are inserted in id order and indexes are built afterwards, then the
+    DB is vacuumed so it has no free pages. sql.js reads the whole file
+    up front, so small pages, which waste less space in half-full pages,
+    make the download smaller.
+    """
+    if target.resolve() == source.resolve():
+        raise ValueError(f"Can't export {source} onto itself")
+    if target.exists():
+        target.unlink()
+    engine = create_engine(f"sqlite:///{target}")
+    with engine.begin() as connection:
+        # sql.js loads the DB from a single file, so no WAL
+        connection.exec_driver_sql("PRAGMA journal_mode=DELETE")
+        connection.exec_driver_sql(f"PRAGMA page_size={page_size}")
+        connection.exec_driver_sql("ATTACH DATABASE ? AS src", (str(source),))
+        for table in ui_metadata.sorted_tables:
+            # Without its indexes, which are built once the rows are in
+            connection.execute(CreateTable(table))
+
+        connection.exec_driver_sql(
+            "INSERT INTO DataSources (id, name, url, creator) "
+            "SELECT id, name, url, creator FROM src.DataSources ORDER BY id"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO AnnotationTypes (id, name) "
+            "SELECT id, name FROM src.AnnotationTypes ORDER BY id"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO AnnotationValues (value) "
+            "SELECT DISTINCT value FROM src.WordAnnotations ORDER BY value"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO Segments (id, start_ms, end_ms, data_source_id) "
+            "SELECT id, start_ms, end_ms, data_source_id FROM src.Segments "
+            "ORDER BY id"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO Words (id, surface_form, segment_id, word_index) "
+            "SELECT id, surface_form, segment_id, word_index FROM src.Words "
+            "ORDER BY id"
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO WordAnnotationCodes "
+            "(id, word_id, annotation_type_id, value_id) "
+            "SELECT a.id, a.word_id, a.annotation_type_id, v.id "
+            "FROM src.WordAnnotations AS a "
+            "JOIN AnnotationValues AS v ON a.value = v.value "
+            "ORDER BY a.id"
+        )
+
+        for table in ui_metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection)
+        for name, query in ui_views.items():
+            connection.exec_driver_sql(f"CREATE VIEW {name} AS {query}")
+        connection.exec_driver_sql("ANALYZE")
+    engine.dispose()
+
+    # VACUUM can't run in a transaction, and applies the page size
+    engine = create_engine(f"sqlite:///{target}", isolation_level="AUTOCOMMIT")
+    with engine.connect() as connection:
+        connection.exec_driver_sql("VACUUM")
+    engine.dispose()
+
+    mode = os.stat(target).st_mode
+    os.chmod(target, mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
@@ -0,0 +1,566 @@
+import re
+from csv import DictReader
+from dataclasses import dataclass
+from itertools import islice, repeat
+from pathlib import Path
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import Connection, Engine, Table, text, update
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select, select
+
+from .annotation import (
+    AnnotationLabels,
+    FusedAnnotator,
+    TokenPredictions,
+    WordPredictions,
+)
+from .pipelining import pipelined
+from .schema import (
+    AnnotationCheckpoint,
+    AnnotationSource,
+    AnnotationType,
+    DataSource,
+    IdSequence,
+    Segment,
+    SwitchPoint,
+    Token,
+    TokenAnnotation,
+    Word,
+    WordAnnotation,
+    word_search,
+)
+
+
+class BulkWriter:
+    """
+    Inserts plain row tuples into schema tables with DBAPI `executemany`.
+
+    Rows are consumed lazily and written in batches of `batch_size`, so the
+    rows for a table never have to be materialized all at once and no ORM
+    objects are created.
+    """
+
+    def __init__(self, connection: Connection, batch_size: int = 10_000):
+        self.connection = connection
+        self.batch_size = batch_size
+
+    def insert(self, table: Table, columns: Sequence[str], rows: Iterable[tuple]):
+        for column in columns:
+            # Fail early on typos rather than with an opaque driver error
+            table.columns[column]
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            table.name, ", ".join(columns), ", ".join("?" * len(columns))
+        )
+        rows = iter(rows)
+        while batch := list(islice(rows, self.batch_size)):
+            self.connection.exec_driver_sql(sql, batch)
+
+
+class IdAllocator:
+    """
+    Hands out ids for one table from blocks reserved in `IdSequences`.
+
+    Each reservation is a single short write transaction on its own
+    connection, so several processes can allocate ids for the same SQLite
+    file without ever receiving overlapping ranges. A table's sequence
+    starts after its highest existing id.
+    """
+
+    def __init__(self, engine: Engine, table: Table, block_size: int = 10_000):
+        self.engine = engine
+        self.table = table
+        self.block_size = block_size
+        self.current_id = 0
+        self.block_end = 0
+
+    def reserve(self, n: int) -> int:
+        """
+        Reserve `n` consecutive ids and return the first one.
+        """
+        with self.engine.begin() as connection:
+            connection.execute(
+                text(
+                    f"INSERT OR IGNORE INTO {IdSequence.__tablename__} "
+                    f"(table_name, next_id) "
+                    f"SELECT :table_name, COALESCE(MAX(id), 0) + 1 FROM {self.table.name}"
+                ),
+                {"table_name": self.table.name},
+            )
+            connection.execute(
+                update(IdSequence)
+                .where(IdSequence.table_name == self.table.name)
+                .values(next_id=IdSequence.next_id + n)
+            )
+            end = connection.scalar(
+                select(IdSequence.next_id).where(
+                    IdSequence.table_name == self.table.name
+                )
+            )
+        assert end is not None
+        return end - n
+
+    def next_ids(self, n: int) -> np.ndarray:
+        available = self.block_end - self.current_id
+        ids = np.arange(self.current_id, self.current_id + min(n, available))
+        if n > available:
+            needed = n - available
+            start = self.reserve(max(needed, self.block_size))
+            self.block_end = start + max(needed, self.block_size)
+            ids = np.concatenate([ids, np.arange(start, start + needed)])
+            self.current_id = start + needed
+        else:
+            self.current_id += n
+        return ids
+
+
+class IdManagers:
+    def __init__(self, engine: Engine):
+        self.segments = IdAllocator(engine, Segment.__table__)  # type: ignore
+        self.tokens = IdAllocator(engine, Token.__table__)  # type: ignore
+        self.words = IdAllocator(engine, Word.__table__)  # type: ignore
+        self.word_annotations = IdAllocator(
+            engine, WordAnnotation.__table__  # type: ignore
+        )
+
+
+def get_one_row(query: Select, session: Session):
+    result = session.scalar(query)
+    if result is None:
+        condition = query.whereclause.compile(compile_kwargs={"literal_binds": True})
+        raise RuntimeError(f"Not in database: {condition}")
+    return result
+
+
+def fetch_metadata(
+    source_name: str,
+    model_name: str,
+    lid_pretrained: str,
+    pos_pretrained: str,
+    session: Session,
+):
+    source = get_one_row(
+        select(DataSource).where(DataSource.name == source_name), session
+    )
+    model = get_one_row(
+        select(AnnotationSource).where(AnnotationSource.name == model_name), session
+    )
+    lid_model = get_one_row(
+        select(AnnotationSource).where(
+            AnnotationSource.url == f"https://huggingface.co/{lid_pretrained}"
+        ),
+        session,
+    )
+    pos_model = get_one_row(
+        select(AnnotationSource).where(
+            AnnotationSource.url == f"https://huggingface.co/{pos_pretrained}"
+        ),
+        session,
+    )
+    lid_type = get_one_row(
+        select(AnnotationType).where(AnnotationType.name == "language"), session
+    )
+    pos_type = get_one_row(
+        select(AnnotationType).where(AnnotationType.name == "pos"), session
+    )
+    switch_type = get_one_row(
+        select(AnnotationType).where(AnnotationType.name == "switch"), session
+    )
+
+    if any(x is None for x in (source, model, lid_model, pos_model)):
+        raise RuntimeError("Source or model is not in database!")
+
+    return source, model, lid_model, pos_model, lid_type, pos_type, switch_type
+
+
+@dataclass
+class AnnotationContext:
+    """
+    Database ids that every row written for one data source refers to.
+    """
+
+    data_source_id: int
+    transcription_source_id: int
+    lid_source_id: int
+    pos_source_id: int
+    lid_type_id: int
+    pos_type_id: int
+    switch_type_id: int
+
+    @classmethod
+    def fetch(
+        cls,
+        session: Session,
+        source_name: str,
+        model_name: str,
+        lid_pretrained: str,
+        pos_pretrained: str,
+    ) -> "AnnotationContext":
+        (
+            source,
+            model,
+            lid_model,
+            pos_model,
+            lid_type,
+            pos_type,
+            switch_type,
+        ) = fetch_metadata(
+            source_name, model_name, lid_pretrained, pos_pretrained, session
+        )
+        return cls(
+            data_source_id=source.id,
+            transcription_source_id=model.id,
+            lid_source_id=lid_model.id,
+            pos_source_id=pos_model.id,
+            lid_type_id=lid_type.id,
+            pos_type_id=pos_type.id,
+            switch_type_id=switch_type.id,
+        )
+
+
+class TranscriptSegment(NamedTuple):
+    start_ms: int
+    end_ms: int
+    text: str
+    # Index of the first transcript row after this segment
+    next_row: int
+
+
+# Bracketed annotations such as "[Music]" that are introduced occasionally
+artifact_re = re.compile(r"\[.+?\] ?")
+
+
+def read_segments(
+    path: Path,
+    start_row: int = 0,
+    max_ms: Optional[int] = 30_000,
+    max_words: Optional[int] = 200,
+) -> Iterator[TranscriptSegment]:
+    """
+    Lazily combine transcript rows into sentence-level segments.
+
+    A segment ends at a row ending in ".", "?" or "!", or once it spans
+    `max_ms` or holds `max_words` whitespace-separated words, so long
+    unpunctuated stretches don't turn into huge model inputs. Rows before
+    `start_row` are skipped, so reading can resume right after the last
+    segment that was written.
+    """
+    with path.open("r") as f:
+        rows = islice(enumerate(DictReader(f)), start_row, None)
+        parts: List[str] = []
+        n_words = 0
+        cur_start = cur_end = 0
+        row_idx = start_row - 1
+        for row_idx, row in rows:
+            text = artifact_re.sub("", row["text"].lstrip(" >").strip())
+            if not text:
+                continue
+
+            if not parts:
+                cur_start = int(row["start"])
+            parts.append(text)
+            n_words += text.count(" ") + 1
+            cur_end = int(row["end"])
+            if (
+                text[-1] in ".?!"
+                or (max_ms is not None and cur_end - cur_start >= max_ms)
+                or (max_words is not None and n_words >= max_words)
+            ):
+                yield TranscriptSegment(
+                    cur_start, cur_end, " ".join(parts), row_idx + 1
+                )
+                parts = []
+                n_words = 0
+        if parts:
+            yield TranscriptSegment(cur_start, cur_end, " ".join(parts), row_idx + 1)
+
+
+def write_annotations(
+    writer: BulkWriter,
+    ids: IdManagers,
+    labels: AnnotationLabels,
+    context: AnnotationContext,
+    transcript_segments: List[TranscriptSegment],
+    predictions: TokenPredictions,
+    words: WordPredictions,
+):
+    """
+    Write the segment, token, word and annotation rows for a batch of
+    annotated segments.
+    """
+    text_segment_ids = ids.segments.next_ids(len(transcript_segments))
+    segments = zip(
+        text_segment_ids.tolist(),
+        [s.start_ms for s in transcript_segments],
+        [s.end_ms for s in transcript_segments],
+        repeat(context.data_source_id),
+    )
+    n_tokens = len(predictions.tokens)
+    n_words = len(words.word_idx)
+    n_switches = len(words.switch_word)
+
+    token_ids = ids.tokens.next_ids(n_tokens)
+    word_ids = ids.words.next_ids(n_words)
+    token_word_ids = word_ids[words.token_word]
+    token_segment_ids = text_segment_ids[predictions.text_idx]
+
+    # Each word gets a language and a pos annotation, followed by its
+    # switch annotations (if any) in the order they were found.
+    word_switches = np.bincount(words.switch_word, minlength=n_words)
+    n_word_annotations = 2 + word_switches
+    word_annotation_ids = ids.word_annotations.next_ids(int(n_word_annotations.sum()))
+    first_annotation = np.cumsum(n_word_annotations) - n_word_annotations
+    lang_annotation_ids = word_annotation_ids[first_annotation]
+    pos_annotation_ids = word_annotation_ids[first_annotation + 1]
+    switch_order = np.argsort(words.switch_word, kind="stable")
+    switch_rank = (
+        np.arange(n_switches)
+        - (np.cumsum(word_switches) - word_switches)[words.switch_word[switch_order]]
+    )
+    switch_annotation_ids = np.empty(n_switches, dtype=np.int64)
+    switch_annotation_ids[switch_order] = word_annotation_ids[
+        first_annotation[words.switch_word[switch_order]] + 2 + switch_rank
+    ]
+    switch_values = np.where(words.switch_into, "into", "from").astype(object)
+    lang_values = np.array(labels.lang_values, dtype=object)
+    pos_values = np.array(labels.pos_labels, dtype=object)
+    token_langs = lang_values[labels.lid_to_lang[predictions.lid]]
+
+    # Token annotations are grouped per word: language, pos, then switch.
+    token_annotation_order = np.argsort(
+        np.concatenate([words.token_word, words.token_word, words.switch_word]),
+        kind="stable",
+    )
+    token_annotations = [
+        np.concatenate(columns)[token_annotation_order].tolist()
+        for columns in (
+            (
+                token_langs,
+                pos_values[predictions.pos],
+                switch_values,
+            ),
+            (
+                predictions.lid_score.astype(float),
+                predictions.pos_score.astype(float),
+                words.switch_confidence.astype(float),
+            ),
+            (token_ids, token_ids, token_ids[words.switch_token]),
+            (
+                np.full(n_tokens, context.lid_type_id),
+                np.full(n_tokens, context.pos_type_id),
+                np.full(n_switches, context.switch_type_id),
+            ),
+            (
+                np.full(n_tokens, context.lid_source_id),
+                np.full(n_tokens, context.pos_source_id),
+                np.full(n_switches, context.lid_source_id),
+            ),
+            (
+                lang_annotation_ids[words.token_word],
+                pos_annotation_ids[words.token_word],
+                switch_annotation_ids,
+            ),
+        )
+    ]
+
+    # For language switches, don't aggregate:
+    # Instead, keep both from + into annotations on the same word
+    word_annotation_order = np.argsort(
+        np.concatenate([lang_annotation_ids, pos_annotation_ids, switch_annotation_ids])
+    )
+    word_annotations = [
+        np.concatenate(columns)[word_annotation_order].tolist()
+        for columns in (
+            (lang_annotation_ids, pos_annotation_ids, switch_annotation_ids),
+            (
+                lang_values[words.lang],
+                pos_values[words.pos],
+                switch_values,
+            ),
+            (
+                words.lang_confidence,
+                words.pos_confidence,
+                words.switch_confidence.astype(float),
+            ),
+            (word_ids, word_ids, word_ids[words.switch_word]),
+            (
+                np.full(n_words, context.lid_type_id),
+                np.full(n_words, context.pos_type_id),
+                np.full(n_switches, context.switch_type_id),
+            ),
+            (
+                np.full(n_words, context.lid_source_id),
+                np.full(n_words, context.pos_source_id),
+                np.full(n_switches, context.lid_source_id),
+            ),
+        )
+    ]
+
+    # Switch arrays hold (from, into) pairs, so every other entry is the
+    # token before or after a switch
+    before, after = words.switch_token[0::2], words.switch_token[1::2]
+    segment_starts = np.array([s.start_ms for s in transcript_segments])
+    switch_points = zip(
+        repeat(context.data_source_id),
+        token_segment_ids[after].tolist(),
+        token_word_ids[after].tolist(),
+        segment_starts[predictions.text_idx[after]].tolist(),
+        token_langs[before].tolist(),
+        token_langs[after].tolist(),
+        words.switch_confidence[0::2].astype(float).tolist(),
+    )
+
+    writer.insert(
+        Segment.__table__,  # type: ignore
+        ("id", "start_ms", "end_ms", "data_source_id"),
+        segments,
+    )
+    writer.insert(
+        Token.__table__,  # type: ignore
+        (
+            "id",
+            "surface_form",
+            "token_index",
+            "segment_id",
+            "transcription_source_id",
+            "word_id",
+        ),
+        zip(
+            token_ids.tolist(),
+            predictions.tokens,
+            predictions.token_index.tolist(),
+            token_segment_ids.tolist(),
+            repeat(context.transcription_source_id),
+            token_word_ids.tolist(),
+        ),
+    )
+    writer.insert(
+        TokenAnnotation.__table__,  # type: ignore
+        (
+            "value",
+            "confidence",
+            "token_id",
+            "annotation_type_id",
+            "annotation_source_id",
+            "word_annotation_id",
+        ),
+        zip(*token_annotations),
+    )
+    writer.insert(
+        Word.__table__,  # type: ignore
+        ("id", "surface_form", "segment_id", "word_index"),
+        zip(
+            word_ids.tolist(),
+            words.surface_form,
+            text_segment_ids[words.text_idx].tolist(),
+            words.word_idx.tolist(),
+        ),
+    )
+    writer.insert(
+        WordAnnotation.__table__,  # type: ignore
+        (
+            "id",
+            "value",
+            "confidence",
+            "word_id",
+            "annotation_type_id",
+            "annotation_source_id",
+        ),
+        zip(*word_annotations),
+    )
+    writer.insert(
+        SwitchPoint.__table__,  # type: ignore
+        (
+            "data_source_id",
+            "segment_id",
+            "word_id",
+            "start_ms",
+            "from_lang",
+            "into_lang",
+            "confidence",
+        ),
+        switch_points,
+    )
+    writer.insert(
+        word_search,
+        ("rowid", "surface_form", "lang", "pos"),
+        zip(
+            word_ids.tolist(),
+            words.surface_form,
+            lang_values[words.lang].tolist(),
+            pos_values[words.pos].tolist(),
+        ),
+    )
+
+
+def get_checkpoint(
+    session: Session, data_source_id: int, transcript: str
+) -> AnnotationCheckpoint:
+    checkpoint = session.scalar(
+        select(AnnotationCheckpoint).where(
+            AnnotationCheckpoint.data_source_id == data_source_id,
+            AnnotationCheckpoint.transcript == transcript,
+        )
+    )
+    if checkpoint is None:
+        checkpoint = AnnotationCheckpoint(
+            data_source_id=data_source_id,
+            transcript=transcript,
+            rows_done=0,
+            finished=False,
+        )
+        session.add(checkpoint)
+    return checkpoint
+
+
+def annotate_source(
+    session: Session,
+    annotator: FusedAnnotator,
+    path: Path,
+    source_name: str,
+    model_name: str,
+    commit_every: int = 500,
+):
+    """
+    Annotate the transcript at `path` into the DB, committing every
+    `commit_every` segments.
+
+    Each commit also records how far into the transcript annotation got, so
+    an interrupted run picks up after the last committed segment. The next
+    batches are read, tokenized and run through the models in background
+    threads while a batch is being written.
+    """
+    context = AnnotationContext.fetch(
+        session,
+        source_name,
+        model_name,
+        annotator.lid_pretrained,
+        annotator.pos_pretrained,
+    )
+    checkpoint = get_checkpoint(session, context.data_source_id, path.name)
+    if checkpoint.finished:
+        return
+
+    ids = IdManagers(session.get_bind())  # type: ignore
+    segments = read_segments(path, start_row=checkpoint.rows_done)
+    batches = iter(lambda: list(islice(segments, commit_every)), [])
+
+    # Reading and tokenizing, running the models, and aggregating and
+    # writing (here, in the thread that owns the session) overlap.
+    for batch, predictions in pipelined(
+        batches,
+        [
+            lambda batch: (batch, annotator.prepare([s.text for s in batch])),
+            lambda item: (item[0], annotator.predict(item[1])),
+        ],
+    ):
+        words = annotator.aggregate(predictions)
+        writer = BulkWriter(session.connection())
+        write_annotations(
+            writer, ids, annotator.labels, context, batch, predictions, words
+        )
+        checkpoint.rows_done = batch[-1].next_row
+        session.commit()
+    checkpoint.finished = True
+    session.commit()
@@ -0,0 +1,153 @@
+from functools import lru_cache
+from inspect import signature
+from typing import Optional
+
+# Loaders for the Hugging Face models used by the pipeline. Importing torch
+# and transformers takes seconds, so they are only imported on first use,
+# and every model is loaded at most once per process.
+
+# Inference backends, selected per model:
+# - "torch": the model as loaded, in full precision
+# - "int8": `nn.Linear` layers dynamically quantized to int8 (CPU only)
+# - "torchscript": a frozen TorchScript trace (CPU only, token classifiers)
+BACKENDS = ("torch", "int8", "torchscript")
+ASR_BACKENDS = ("torch", "int8")
+
+
+@lru_cache(maxsize=None)
+def get_device() -> str:
+    import torch
+
+    if torch.cuda.is_available():
+        return "cuda:0"
+    elif torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+@lru_cache(maxsize=None)
+def load_config(name: str):
+    from transformers import AutoConfig
+
+    return AutoConfig.from_pretrained(name)
+
+
+@lru_cache(maxsize=None)
+def load_tokenizer(name: str):
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(name)
+
+
+def process_context():
+    """
+    Multiprocessing context for worker processes that run models.
+    """
+    import multiprocessing
+
+    # Forking after torch has started threads can deadlock
+    return multiprocessing.get_context("spawn")
+
+
+def configure_torch_threads(
+    threads: Optional[int] = None, interop_threads: Optional[int] = None
+):
+    """
+    Set how many threads torch uses within an op (`threads`) and to run
+    independent ops in parallel (`interop_threads`). `None` keeps torch's
+    default, which is one thread per core for both.
+
+    The inter-op pool can only be sized before torch first uses it, so call
+    this before loading any model.
+    """
+    import torch
+
+    if threads is not None:
+        torch.set_num_threads(threads)
+    if interop_threads is not None:
+        torch.set_num_interop_threads(interop_threads)
+
+
+def backend_device(*backends: str) -> str:
+    """
+    Device to run models with the given backends on.
+    """
+    for backend in backends:
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+    if all(backend == "torch" for backend in backends):
+        return get_device()
+    return "cpu"
+
+
+def quantize(model):
+    import torch
+
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+class TracedTokenClassifier:
+    """
+    TorchScript trace of a token classifier, called like the original model.
+    """
+
+    def __init__(self, model, example: dict):
+        import torch
+
+        self.config = model.config
+        # A trace takes positional inputs, in the order `forward` declares them
+        self.input_names = [
+            name for name in signature(model.forward).parameters if name in example
+        ]
+        with torch.no_grad():
+            traced = torch.jit.trace(
+                model,
+                tuple(example[name] for name in self.input_names),
+                strict=False,
+                check_trace=False,
+            )
+        self.traced = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+
+    def __call__(self, **inputs):
+        from transformers.modeling_outputs import TokenClassifierOutput
+
+        outputs = self.traced(*(inputs[name] for name in self.input_names))
+        return TokenClassifierOutput(logits=outputs[0])
+
+
+@lru_cache(maxsize=None)
+def load_token_classifier(name: str, device: str, backend: str = "torch"):
+    from transformers import AutoModelForTokenClassification
+
+    model = AutoModelForTokenClassification.from_pretrained(
+        name, torchscript=backend == "torchscript"
+    ).to(device)
+    model.eval()
+    if backend == "int8":
+        return quantize(model)
+    if backend == "torchscript":
+        # Padded so the trace covers batches with an attention mask
+        example = load_tokenizer(name)(
+            ["hola", "hello, how are you today?"], padding=True, return_tensors="pt"
+        )
+        return TracedTokenClassifier(model, dict(example))
+    return model
+
+
+@lru_cache(maxsize=None)
+def load_asr_pipeline(name: str, device: str, backend: str = "torch"):
+    from transformers import pipeline
+
+    if backend not in ASR_BACKENDS:
+        raise ValueError(f"Backend {backend!r} isn't supported for ASR")
+    pipe = pipeline(
+        "automatic-speech-recognition",
+        model=name,
+        device=device,
+        generate_kwargs={"task": "transcribe"},
+    )
+    if backend == "int8":
+        pipe.model = quantize(pipe.model)
+    return pipe
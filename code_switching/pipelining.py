@@ -0,0 +1,82 @@
+import threading
+from queue import Empty, Full, Queue
+from typing import Any, Callable, Iterable, Iterator, List, Sequence
+
+_done = object()
+
+
+def pipelined(
+    items: Iterable[Any],
+    stages: Sequence[Callable[[Any], Any]],
+    maxsize: int = 2,
+) -> Iterator[Any]:
+    """
+    Run `items` through `stages`, each stage in its own thread, and yield
+    the last stage's outputs in order.
+
+    Stages are connected by queues holding at most `maxsize` items, so a
+    fast stage runs at most that far ahead of the next one. Iterating
+    `items` happens in a thread of its own too. This overlaps stages that
+    release the GIL, like tokenization, torch ops and I/O. The first error
+    raised in any stage is re-raised here.
+    """
+    queues: List[Queue] = [Queue(maxsize=maxsize) for _ in range(len(stages) + 1)]
+    stop = threading.Event()
+    errors: List[BaseException] = []
+
+    def put(queue: Queue, item: Any) -> bool:
+        while not stop.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def get(queue: Queue) -> Any:
+        while not stop.is_set():
+            try:
+                return queue.get(timeout=0.1)
+            except Empty:
+                continue
+        return _done
+
+    def feed():
+        try:
+            for item in items:
+                if not put(queues[0], item):
+                    return
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            put(queues[0], _done)
+
+    def run(stage: Callable[[Any], Any], inbox: Queue, outbox: Queue):
+        try:
+            while (item := get(inbox)) is not _done:
+                if not put(outbox, stage(item)):
+                    return
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            put(outbox, _done)
+
+    threads = [threading.Thread(target=feed, daemon=True)] + [
+        threading.Thread(
+            target=run, args=(stage, queues[i], queues[i + 1]), daemon=True
+        )
+        for i, stage in enumerate(stages)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        while (item := get(queues[-1])) is not _done:
+            yield item
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    if errors:
+        raise errors[0]
@@ -1,7 +1,23 @@
 import csv
-from typing import List, Optional
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, List, Optional
 
-from sqlalchemy import Engine
+from sqlalchemy import (
+    Column,
+    Engine,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    UniqueConstraint,
+    create_engine,
+    event,
+    inspect,
+    select,
+    text,
+)
 from sqlalchemy.orm import (
     Mapped,
     Session,
@@ -10,6 +26,7 @@ from sqlalchemy.orm import (
     relationship,
 )
 from sqlalchemy.orm.properties import ForeignKey
+from sqlalchemy.schema import CreateIndex, DropIndex
 
 from . import config
 
@@ -54,6 +71,10 @@ class AnnotationType(Base):
 
 class Token(Base):
     __tablename__ = "Tokens"
+    __table_args__ = (
+        Index("ix_tokens_segment", "segment_id", "token_index"),
+        Index("ix_tokens_word", "word_id"),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     surface_form: Mapped[str] = mapped_column()
     token_index: Mapped[int] = mapped_column()
@@ -70,6 +91,7 @@ class Token(Base):
 
 class Word(Base):
     __tablename__ = "Words"
+    __table_args__ = (Index("ix_words_segment", "segment_id", "word_index"),)
     id: Mapped[int] = mapped_column(primary_key=True)
     surface_form: Mapped[str] = mapped_column()
     tokens: Mapped[List["Token"]] = relationship(back_populates="word")
@@ -81,6 +103,7 @@ class Word(Base):
 
 class Segment(Base):
     __tablename__ = "Segments"
+    __table_args__ = (Index("ix_segments_source", "data_source_id", "start_ms"),)
     id: Mapped[int] = mapped_column(primary_key=True)
     confidence: Mapped[Optional[float]] = mapped_column()
     start_ms: Mapped[int] = mapped_column()
@@ -91,6 +114,10 @@ class Segment(Base):
 
 class TokenAnnotation(Base):
     __tablename__ = "TokenAnnotations"
+    __table_args__ = (
+        Index("ix_token_annotations_token", "token_id", "annotation_type_id"),
+        Index("ix_token_annotations_word_annotation", "word_annotation_id"),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     value: Mapped[str] = mapped_column()
     confidence: Mapped[float] = mapped_column()
@@ -107,6 +134,12 @@ class TokenAnnotation(Base):
 
 class WordAnnotation(Base):
     __tablename__ = "WordAnnotations"
+    __table_args__ = (
+        # Covers looking up all annotations of a word
+        Index("ix_word_annotations_word", "word_id", "annotation_type_id", "value"),
+        # Covers finding the words with a given annotation type (e.g. switches)
+        Index("ix_word_annotations_type", "annotation_type_id", "word_id"),
+    )
     id: Mapped[int] = mapped_column(primary_key=True)
     value: Mapped[str] = mapped_column()
     confidence: Mapped[float] = mapped_column()
@@ -120,8 +153,269 @@ class WordAnnotation(Base):
     annotation_source: Mapped["AnnotationSource"] = relationship()
 
 
+class AnnotationCheckpoint(Base):
+    __tablename__ = "AnnotationCheckpoints"
+    __table_args__ = (UniqueConstraint("data_source_id", "transcript"),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    data_source_id: Mapped[int] = mapped_column(ForeignKey("DataSources.id"))
+    data_source: Mapped["DataSource"] = relationship()
+    # File name of the transcript, as a source can have many episodes
+    transcript: Mapped[str] = mapped_column()
+    # Number of transcript rows whose segments have been committed
+    rows_done: Mapped[int] = mapped_column()
+    finished: Mapped[bool] = mapped_column()
+
+
+class SwitchPoint(Base):
+    # One row per language switch between consecutive tokens, copied out of
+    # the switch annotations so switches can be looked up by source and time
+    # without joining through the annotation tables
+    __tablename__ = "SwitchPoints"
+    __table_args__ = (Index("ix_switch_points_source", "data_source_id", "start_ms"),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    data_source_id: Mapped[int] = mapped_column(ForeignKey("DataSources.id"))
+    data_source: Mapped["DataSource"] = relationship()
+    segment_id: Mapped[int] = mapped_column(ForeignKey("Segments.id"))
+    segment: Mapped["Segment"] = relationship()
+    # Word containing the first token after the switch
+    word_id: Mapped[int] = mapped_column(ForeignKey("Words.id"))
+    word: Mapped["Word"] = relationship()
+    # Start of the segment, since words have no timestamps of their own
+    start_ms: Mapped[int] = mapped_column()
+    from_lang: Mapped[str] = mapped_column()
+    into_lang: Mapped[str] = mapped_column()
+    confidence: Mapped[float] = mapped_column()
+
+
+class IdSequence(Base):
+    __tablename__ = "IdSequences"
+    table_name: Mapped[str] = mapped_column(primary_key=True)
+    next_id: Mapped[int] = mapped_column()
+
+
+# FTS5 index of word surface forms, with each word's language and POS so
+# searches can filter on them. The rowid is the word id. Accents are folded
+# so "esta" also finds "está".
+word_search = Table(
+    "WordSearch",
+    MetaData(),
+    Column("rowid", Integer, primary_key=True),
+    Column("surface_form", String),
+    Column("lang", String),
+    Column("pos", String),
+)
+
+
+def create_word_search(engine: Engine):
+    """
+    Create the `WordSearch` index if it doesn't exist yet, filling it from
+    the words already in the DB.
+    """
+    if inspect(engine).has_table(word_search.name):
+        return
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE {word_search.name} USING fts5("
+            "surface_form, lang, pos, tokenize='unicode61 remove_diacritics 2')"
+        )
+        connection.execute(
+            text(
+                f"""
+                INSERT INTO {word_search.name} (rowid, surface_form, lang, pos)
+                SELECT w.id, w.surface_form, lang.value, pos.value
+                FROM Words AS w
+                JOIN WordAnnotations AS lang
+                    ON lang.word_id = w.id
+                    AND lang.annotation_type_id = (
+                        SELECT id FROM AnnotationTypes WHERE name = 'language'
+                    )
+                JOIN WordAnnotations AS pos
+                    ON pos.word_id = w.id
+                    AND pos.annotation_type_id = (
+                        SELECT id FROM AnnotationTypes WHERE name = 'pos'
+                    )
+                """
+            )
+        )
+
+
+def set_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    # WAL lets the UI and other processes read while annotation is writing,
+    # and with it, NORMAL sync only fsyncs at checkpoints.
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    # 256 MiB page cache
+    cursor.execute("PRAGMA cache_size=-262144")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def create_db_engine(db: Optional[Path] = None) -> Engine:
+    engine = create_engine(
+        f"sqlite:///{db or ':memory:'}",
+        # Other annotation processes may be writing to the same DB
+        connect_args={"timeout": 60},
+    )
+    event.listen(engine, "connect", set_pragmas)
+    return engine
+
+
+def open_db(db: Optional[Path] = None) -> Engine:
+    """
+    Connect to the DB at `db`, creating and initializing it if it doesn't
+    exist yet.
+    """
+    prev_db_exists = db and db.exists()
+    engine = create_db_engine(db)
+    # Initialize the DB tables if the DB didn't exist already
+    if not prev_db_exists:
+        initialize(engine)
+    else:
+        had_switch_points = inspect(engine).has_table(SwitchPoint.__tablename__)
+        # Pick up any tables added to the schema since the DB was created
+        Base.metadata.create_all(engine)
+        # `create_all` skips existing tables, and so their new indexes
+        create_indexes(engine)
+        if not had_switch_points:
+            fill_switch_points(engine)
+        create_word_search(engine)
+    return engine
+
+
+def fill_switch_points(engine: Engine):
+    """
+    Derive `SwitchPoints` rows from the token-level switch annotations
+    already in the DB.
+
+    Every "from" annotation is on the last token before a switch; the token
+    after it is the next token of the same segment.
+    """
+    with engine.begin() as connection:
+        type_ids = {
+            name: connection.scalar(
+                select(AnnotationType.id).where(AnnotationType.name == name)
+            )
+            for name in ("language", "switch")
+        }
+        connection.execute(
+            text(
+                """
+                INSERT INTO SwitchPoints (
+                    data_source_id, segment_id, word_id, start_ms,
+                    from_lang, into_lang, confidence
+                )
+                SELECT s.data_source_id, s.id, after.word_id, s.start_ms,
+                    before_lang.value, after_lang.value, switch.confidence
+                FROM TokenAnnotations AS switch
+                JOIN Tokens AS before ON switch.token_id = before.id
+                JOIN Tokens AS after
+                    ON after.segment_id = before.segment_id
+                    AND after.token_index = before.token_index + 1
+                JOIN TokenAnnotations AS before_lang
+                    ON before_lang.token_id = before.id
+                    AND before_lang.annotation_type_id = :language
+                JOIN TokenAnnotations AS after_lang
+                    ON after_lang.token_id = after.id
+                    AND after_lang.annotation_type_id = :language
+                JOIN Segments AS s ON before.segment_id = s.id
+                WHERE switch.annotation_type_id = :switch
+                    AND switch.value = 'from'
+                ORDER BY switch.id
+                """
+            ),
+            type_ids,
+        )
+
+
+def query_indexes() -> List[Index]:
+    return [index for table in Base.metadata.sorted_tables for index in table.indexes]
+
+
+def create_indexes(engine: Engine):
+    """
+    Create any of the query indexes the DB doesn't have yet.
+    """
+    with engine.begin() as connection:
+        for index in query_indexes():
+            connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+@contextmanager
+def bulk_load(engine: Engine) -> Iterator[None]:
+    """
+    Load rows into the DB, dropping the query indexes while loading into
+    empty tables and rebuilding them afterwards.
+
+    Building an index once over the loaded rows is much cheaper than
+    updating it on every insert, but rebuilding the indexes of a DB that
+    already holds a corpus costs more than loading one more transcript, so
+    indexes are only dropped for the first load. Indexes are rebuilt even if
+    loading fails, so the DB is always left queryable. Drops and rebuilds
+    are `IF EXISTS`/`IF NOT EXISTS`, so several processes can load into the
+    same DB at once.
+    """
+    with engine.connect() as connection:
+        empty = connection.scalar(select(Segment.id).limit(1)) is None
+    if empty:
+        with engine.begin() as connection:
+            for index in query_indexes():
+                connection.execute(DropIndex(index, if_exists=True))
+    try:
+        yield
+    finally:
+        create_indexes(engine)
+        with engine.begin() as connection:
+            # Only this DB: shards have the catalog attached, and analyzing it
+            # would make every shard writer write to the catalog too
+            if empty:
+                connection.exec_driver_sql("ANALYZE main")
+                if inspect(connection).has_table(word_search.name):
+                    # Merge the index segments written by each batch
+                    connection.exec_driver_sql(
+                        f"INSERT INTO {word_search.name} ({word_search.name}) "
+                        "VALUES ('optimize')"
+                    )
+            else:
+                # Only re-analyzes tables whose statistics are out of date
+                connection.exec_driver_sql("PRAGMA main.optimize")
+
+
+# Tables shared by all data sources. In a sharded layout (see
+# `code_switching.shards`) these live in the catalog DB and all other tables
+# in one shard DB per data source.
+catalog_tables = [
+    Format.__table__,
+    DataSource.__table__,
+    AnnotationSource.__table__,
+    AnnotationType.__table__,
+]
+shard_tables = [t for t in Base.metadata.sorted_tables if t not in catalog_tables]
+
+
 def initialize(engine: Engine):
-    Base.metadata.create_all(engine)
+    initialize_catalog(engine)
+    initialize_shard(engine)
+
+
+def initialize_shard(engine: Engine, first_id: int = 1):
+    """
+    Create the segment, word and annotation tables. Ids handed out by
+    `IdAllocator`s start at `first_id`.
+    """
+    Base.metadata.create_all(engine, tables=shard_tables)
+    create_word_search(engine)
+    if first_id > 1:
+        with Session(engine) as session:
+            session.add_all(
+                IdSequence(table_name=table.__tablename__, next_id=first_id)
+                for table in (Segment, Token, Word, WordAnnotation)
+            )
+            session.commit()
+
+
+def initialize_catalog(engine: Engine):
+    Base.metadata.create_all(engine, tables=catalog_tables)
     with Session(engine) as session:
         audio_fmt = Format(name="audio")
         text_fmt = Format(name="text")
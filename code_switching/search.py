@@ -0,0 +1,100 @@
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import Connection, text
+
+from .schema import word_search
+
+
+class SearchHit(NamedTuple):
+    segment_id: int
+    start_ms: int
+    end_ms: int
+    data_source_id: int
+
+
+def quote(term: str) -> str:
+    # FTS5 strings are double-quoted, with embedded quotes doubled
+    return '"' + term.replace('"', '""') + '"'
+
+
+def match_expression(
+    query: str, lang: Optional[str] = None, pos: Optional[str] = None
+) -> str:
+    """
+    Build an FTS5 `MATCH` expression for words matching any term of
+    `query`, optionally restricted to a language and/or POS tag.
+
+    A term ending in "*" matches any word starting with it.
+    """
+    terms = []
+    for term in query.split():
+        if term.endswith("*") and len(term) > 1:
+            terms.append(quote(term[:-1]) + "*")
+        else:
+            terms.append(quote(term))
+    if not terms:
+        raise ValueError("Empty search query")
+    expression = "surface_form : (" + " OR ".join(terms) + ")"
+    if lang is not None:
+        expression += f" AND lang : {quote(lang)}"
+    if pos is not None:
+        expression += f" AND pos : {quote(pos)}"
+    return expression
+
+
+def search_schemas(connection: Connection) -> List[str]:
+    """
+    Names of the attached DBs that have a `WordSearch` index: the main DB,
+    or, on a `ShardedCorpus` connection, every attached shard.
+    """
+    names = [row[1] for row in connection.exec_driver_sql("PRAGMA database_list")]
+    return [
+        name
+        for name in names
+        if name != "temp"
+        and connection.scalar(
+            text(f"SELECT 1 FROM {name}.sqlite_master WHERE name = :table"),
+            {"table": word_search.name},
+        )
+    ]
+
+
+def search(
+    connection: Connection,
+    query: str,
+    lang: Optional[str] = None,
+    pos: Optional[str] = None,
+    data_source_id: Optional[int] = None,
+    limit: int = 100,
+) -> List[SearchHit]:
+    """
+    Find the segments containing a word that matches `query`, in data source
+    and time order.
+
+    `lang` is an ISO 639-3 code as stored in word annotations (e.g. "spa")
+    and `pos` a tag of the POS model (e.g. "NOUN"). Matching ignores case
+    and accents. Every DB with a search index is searched, so this works on
+    a single corpus DB as well as on a catalog with shards attached.
+    """
+    params = {"match": match_expression(query, lang, pos), "limit": limit}
+    where = ""
+    if data_source_id is not None:
+        where = " AND s.data_source_id = :data_source_id"
+        params["data_source_id"] = data_source_id
+    queries = [
+        f"""
+        SELECT s.id, s.start_ms, s.end_ms, s.data_source_id
+        FROM {schema}.{word_search.name} AS f
+        JOIN {schema}.Words AS w ON w.id = f.rowid
+        JOIN {schema}.Segments AS s ON s.id = w.segment_id
+        WHERE f.{word_search.name} MATCH :match{where}
+        """
+        for schema in search_schemas(connection)
+    ]
+    if not queries:
+        raise RuntimeError(f"No {word_search.name} index in the DB")
+    sql = f"""
+        SELECT DISTINCT * FROM ({" UNION ALL ".join(queries)})
+        ORDER BY data_source_id, start_ms LIMIT :limit
+    """
+    return [SearchHit(*row) for row in connection.execute(text(sql), params)]
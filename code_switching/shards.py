@@ -0,0 +1,124 @@
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator
+
+from sqlalchemy import Connection, Engine, event, select
+
+from .schema import (
+    DataSource,
+    create_db_engine,
+    initialize_catalog,
+    initialize_shard,
+    shard_tables,
+)
+
+# Each shard's ids start at `data_source_id << SHARD_ID_BITS`, so ids stay
+# unique across shards without the writers having to coordinate, and still
+# fit in a JavaScript number for the UI.
+SHARD_ID_BITS = 32
+
+
+class ShardedCorpus:
+    """
+    A corpus split into a catalog DB and one shard DB per data source.
+
+    The catalog at `root / "catalog.db"` holds the data sources, formats and
+    annotation types and sources. Each shard under `root / "shards"` holds
+    the segments, words and annotations of one data source, so sources can
+    be annotated in parallel without contending on a single DB file, and
+    readers only open the shards they need.
+
+    Shard connections have the catalog attached, so unqualified references
+    to catalog tables resolve there and annotation code runs unchanged
+    against a shard engine.
+    """
+
+    def __init__(self, root: Path):
+        self.root = root
+        (root / "shards").mkdir(parents=True, exist_ok=True)
+        catalog_path = root / "catalog.db"
+        prev_catalog_exists = catalog_path.exists()
+        self.catalog = create_db_engine(catalog_path)
+        if not prev_catalog_exists:
+            initialize_catalog(self.catalog)
+        self.shards: Dict[int, Engine] = {}
+
+    def data_source_id(self, source_name: str) -> int:
+        with self.catalog.connect() as connection:
+            data_source_id = connection.scalar(
+                select(DataSource.id).where(DataSource.name == source_name)
+            )
+        if data_source_id is None:
+            raise ValueError(f"Unknown data source {source_name!r}")
+        return data_source_id
+
+    def shard_path(self, data_source_id: int) -> Path:
+        return self.root / "shards" / f"{data_source_id}.db"
+
+    def shard(self, data_source_id: int) -> Engine:
+        """
+        Engine for a data source's shard, creating the shard if needed.
+        """
+        if data_source_id in self.shards:
+            return self.shards[data_source_id]
+
+        path = self.shard_path(data_source_id)
+        prev_shard_exists = path.exists()
+        engine = create_db_engine(path)
+        catalog_path = str(self.root / "catalog.db")
+
+        @event.listens_for(engine, "connect")
+        def attach_catalog(dbapi_connection, connection_record):
+            dbapi_connection.execute("ATTACH DATABASE ? AS catalog", (catalog_path,))
+
+        if not prev_shard_exists:
+            initialize_shard(engine, first_id=data_source_id << SHARD_ID_BITS)
+        self.shards[data_source_id] = engine
+        return engine
+
+    @contextmanager
+    def connect(self) -> Iterator[Connection]:
+        """
+        Connection to the catalog, to which shards can be attached with
+        `attach`.
+        """
+        with self.catalog.connect() as connection:
+            yield connection
+
+    def attach(self, connection: Connection, data_source_ids: Iterable[int]):
+        """
+        Attach the shards of `data_source_ids` to a catalog connection, if
+        they aren't attached already.
+
+        Temporary views named after the shard tables combine all attached
+        shards, so queries written for a single corpus DB work as before.
+        FTS tables can't be combined in a view, so each shard keeps its own
+        `WordSearch` index; `search.search` queries all of them.
+        SQLite limits how many DBs can be attached at once (10 by default).
+        """
+        attached = {
+            row[1] for row in connection.exec_driver_sql("PRAGMA database_list")
+        }
+        added = False
+        for data_source_id in data_source_ids:
+            name = f"shard_{data_source_id}"
+            if name in attached or not self.shard_path(data_source_id).exists():
+                continue
+            connection.exec_driver_sql(
+                f"ATTACH DATABASE ? AS {name}",
+                (str(self.shard_path(data_source_id)),),
+            )
+            attached.add(name)
+            added = True
+        if not added:
+            return
+
+        shards = sorted(name for name in attached if name.startswith("shard_"))
+        for table in shard_tables:
+            connection.exec_driver_sql(f"DROP VIEW IF EXISTS temp.{table.name}")
+            connection.exec_driver_sql(
+                f"CREATE TEMP VIEW {table.name} AS "
+                + " UNION ALL ".join(
+                    f"SELECT * FROM {shard}.{table.name}" for shard in shards
+                )
+            )
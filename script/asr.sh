@@ -2,15 +2,16 @@
 set -euo pipefail
 
 input_path="$2"
-wav_path="${input_path%.*}.wav"
 out_path="${input_path%.*}"
 
-ffmpeg -i "$input_path" -ar 16000 -ac 1 -c:a pcm_s16le "$wav_path" \
-  && whisper-cpp \
+# Stream 16 kHz mono audio straight into whisper-cpp instead of writing a
+# temporary WAV file next to the input.
+ffmpeg -nostdin -loglevel error -i "$input_path" -ar 16000 -ac 1 -c:a pcm_s16le -f wav - \
+  | whisper-cpp \
     --language auto \
     --model "$1" \
     --output-file "$out_path" \
     --processors 4 \
-    --output-csv "$wav_path" \
+    --output-csv \
     "${@:3}" \
-  && rm -f "$wav_path"
+    -
@@ -0,0 +1,125 @@
+import time
+from itertools import islice
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import typer
+
+from code_switching.annotation import LID_PRETRAINED, POS_PRETRAINED, FusedAnnotator
+from code_switching.asr import AsrEngine, AsrResult
+from code_switching.ingest import read_segments
+
+app = typer.Typer()
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - start
+
+
+@app.command()
+def annotation(
+    transcripts: List[Path],
+    backend: str,
+    sample: int = 1000,
+    batch_size: int = 32,
+    min_agreement: float = 0.99,
+):
+    """
+    Compare LID/POS predictions of `backend` against the PyTorch models on
+    the first `sample` segments of `transcripts`.
+    """
+    texts = [
+        s.text
+        for s in islice(
+            (s for path in transcripts for s in read_segments(path)), sample
+        )
+    ]
+    reference = FusedAnnotator(LID_PRETRAINED, POS_PRETRAINED, batch_size)
+    candidate = FusedAnnotator(
+        LID_PRETRAINED,
+        POS_PRETRAINED,
+        batch_size,
+        lid_backend=backend,
+        pos_backend=backend,
+    )
+    # Warm up both before timing
+    reference.annotate(texts[:batch_size])
+    candidate.annotate(texts[:batch_size])
+    expected, reference_s = timed(reference.annotate, texts)
+    actual, candidate_s = timed(candidate.annotate, texts)
+    expected_words = reference.aggregate(expected)
+    actual_words = candidate.aggregate(actual)
+
+    agreement = {
+        "token LID": (actual.lid == expected.lid).mean(),
+        "token POS": (actual.pos == expected.pos).mean(),
+        "word language": (actual_words.lang == expected_words.lang).mean(),
+        "word POS": (actual_words.pos == expected_words.pos).mean(),
+    }
+    typer.echo(f"{len(texts)} segments, {len(expected.tokens)} tokens")
+    for name, value in agreement.items():
+        typer.echo(f"{name} agreement: {value:.4f}")
+    typer.echo(
+        f"switches: {len(expected_words.switch_token) // 2} with torch, "
+        f"{len(actual_words.switch_token) // 2} with {backend}"
+    )
+    typer.echo(
+        f"torch: {reference_s:.2f}s, {backend}: {candidate_s:.2f}s "
+        f"({reference_s / candidate_s:.2f}x)"
+    )
+    if min(agreement.values()) < min_agreement:
+        raise typer.Exit(1)
+
+
+@app.command()
+def asr(
+    audio: List[Path],
+    backend: str,
+    model_name: str = "openai/whisper-small",
+    batch_size: int = 8,
+    min_agreement: float = 0.95,
+):
+    """
+    Compare Whisper language probabilities and transcripts of `backend`
+    against the PyTorch model on `audio`.
+    """
+    reference = AsrEngine(model_name, batch_size=batch_size)
+    candidate = AsrEngine(model_name, batch_size=batch_size, backend=backend)
+
+    def transcribe(engine: AsrEngine) -> AsrResult:
+        return AsrResult.concatenate([r for _, r in engine.transcribe(audio)])
+
+    expected, reference_s = timed(transcribe, reference)
+    actual, candidate_s = timed(transcribe, candidate)
+
+    language_agreement = (
+        (actual.en_prob > actual.es_prob) == (expected.en_prob > expected.es_prob)
+    ).mean()
+    text_agreement = np.mean(
+        [
+            a == e
+            for a, e in zip(
+                actual.en_text + actual.es_text, expected.en_text + expected.es_text
+            )
+        ]
+    )
+    typer.echo(f"{len(expected)} chunks")
+    typer.echo(f"language agreement: {language_agreement:.4f}")
+    typer.echo(
+        "max language probability difference: "
+        f"{np.abs(actual.en_prob - expected.en_prob).max():.4f}"
+    )
+    typer.echo(f"identical transcripts: {text_agreement:.4f}")
+    typer.echo(
+        f"torch: {reference_s:.2f}s, {backend}: {candidate_s:.2f}s "
+        f"({reference_s / candidate_s:.2f}x)"
+    )
+    if language_agreement < min_agreement:
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    app()
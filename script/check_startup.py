@@ -0,0 +1,68 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import typer
+
+root = Path(__file__).resolve().parent.parent
+
+# `--help` has to answer without importing torch or transformers, which is
+# also what makes argument and DB errors show up quickly.
+commands = {
+    "annotate": ["script/annotate.py", "--help"],
+    "corpus_annotate": ["-m", "code_switching.corpus_annotate", "--help"],
+    "corpus_asr": ["-m", "code_switching.corpus_asr", "--help"],
+}
+heavy_modules = ["torch", "transformers"]
+
+
+def startup_time(args, runs: int) -> float:
+    env = {**os.environ, "PYTHONPATH": str(root)}
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, *args], cwd=root, env=env, check=True, capture_output=True
+        )
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def heavy_imports(module: str) -> list:
+    check = (
+        f"import sys, {module}; "
+        f"print(' '.join(m for m in {heavy_modules!r} if m in sys.modules))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", check],
+        cwd=root,
+        env={**os.environ, "PYTHONPATH": str(root)},
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return output.split()
+
+
+def main(budget_s: float = 1.5, runs: int = 3):
+    failed = False
+    for name, args in commands.items():
+        elapsed = startup_time(args, runs)
+        over = elapsed > budget_s
+        failed |= over
+        typer.echo(f"{name}: {elapsed:.2f}s{' (over budget)' if over else ''}")
+
+    for module in ["code_switching.ingest", "code_switching.annotation"]:
+        imported = heavy_imports(module)
+        if imported:
+            failed = True
+            typer.echo(f"{module} imports {', '.join(imported)} eagerly")
+
+    if failed:
+        raise typer.Exit(1)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,14 @@
+from pathlib import Path
+
+import typer
+
+from code_switching.columnar import export_columns
+from code_switching.schema import create_db_engine
+
+
+def main(db: Path, output: Path):
+    export_columns(create_db_engine(db), output)
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,22 @@
+from pathlib import Path
+
+import typer
+
+from code_switching.export import export_ui_db
+
+
+def main(
+    db: Path,
+    output: Path = Path("ui/src/assets/escoco.db"),
+    page_size: int = 1024,
+):
+    if output.resolve() == db.resolve():
+        raise typer.BadParameter(
+            "The output would overwrite the DB", param_hint="output"
+        )
+    export_ui_db(db, output, page_size)
+    typer.echo(f"Wrote {output} ({output.stat().st_size / 2**20:.1f} MiB)")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,130 @@
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import pytest
+from sqlalchemy import Engine
+from sqlalchemy.orm import Session
+
+from code_switching import config
+from code_switching.annotation import (
+    LID_PRETRAINED,
+    POS_PRETRAINED,
+    AnnotationLabels,
+    FusedAnnotator,
+    TokenPredictions,
+)
+from code_switching.ingest import (
+    AnnotationContext,
+    BulkWriter,
+    IdManagers,
+    TranscriptSegment,
+    write_annotations,
+)
+from code_switching.schema import open_db
+
+METADATA = (
+    "Name\tLink\tModality\tCreator\tContent\tSize\tTagged\tScripted\tComments\n"
+    "que pasa\thttps://example.com\tSpoken\tSomeone\tPodcast\t1h\tn\tn\t\n"
+    "otra\thttps://example.org\tSpoken\tSomeone else\tRadio\t2h\tn\tn\t\n"
+)
+
+
+@pytest.fixture
+def data_dir(tmp_path: Path, monkeypatch) -> Path:
+    """A data directory listing the data sources in `METADATA`."""
+    (tmp_path / "metadata.tsv").write_text(METADATA)
+    monkeypatch.setattr(config, "DATA_DIR", tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def engine(data_dir: Path) -> Engine:
+    return open_db(data_dir / "corpus.db")
+
+
+@pytest.fixture
+def context(engine: Engine) -> AnnotationContext:
+    with Session(engine) as session:
+        return AnnotationContext.fetch(
+            session, "que pasa", "whisper-small", LID_PRETRAINED, POS_PRETRAINED
+        )
+
+
+@pytest.fixture
+def labels() -> AnnotationLabels:
+    lid_labels = ["en", "spa", "other"]
+    lang_values = ["eng", "n/a", "spa"]
+    return AnnotationLabels(
+        lid_labels=lid_labels,
+        pos_labels=["NOUN", "VERB", "PUNCT"],
+        lang_values=lang_values,
+        lid_to_lang=np.array([0, 2, 1]),
+        switch_langs=np.array([True, False, True]),
+    )
+
+
+class WordPieceTokenizer:
+    def convert_tokens_to_string(self, tokens):
+        return "".join(t[2:] if t.startswith("##") else " " + t for t in tokens).strip()
+
+
+@pytest.fixture
+def annotator(labels: AnnotationLabels) -> FusedAnnotator:
+    # `aggregate` only needs the labels and the tokenizer, not the models
+    annotator = object.__new__(FusedAnnotator)
+    annotator.labels = labels
+    annotator.tokenizer = WordPieceTokenizer()
+    return annotator
+
+
+@pytest.fixture
+def predictions() -> TokenPredictions:
+    """
+    Two texts, "hola my friend" and "ok si !", with switches spa -> eng and
+    eng -> spa (inside "friend") in the first and eng -> spa in the second.
+    """
+    en, spa, other = 0, 1, 2
+    noun, verb, punct = 0, 1, 2
+    return TokenPredictions(
+        text_idx=np.array([0, 0, 0, 0, 1, 1, 1]),
+        token_index=np.array([1, 2, 3, 4, 1, 2, 3]),
+        word_idx=np.array([0, 1, 2, 2, 0, 1, 2]),
+        tokens=["hola", "my", "fri", "##end", "ok", "si", "!"],
+        lid=np.array([spa, en, en, spa, en, spa, other]),
+        lid_score=np.array([0.9, 0.8, 0.6, 0.3, 0.7, 0.5, 0.99], dtype=np.float32),
+        pos=np.array([noun, noun, noun, verb, verb, noun, punct]),
+        pos_score=np.array([0.5, 0.5, 0.4, 0.6, 0.9, 0.8, 1.0], dtype=np.float32),
+    )
+
+
+@pytest.fixture
+def write_example(
+    annotator: FusedAnnotator, predictions: TokenPredictions
+) -> Callable[[Engine, AnnotationContext], None]:
+    """Write `predictions` as two segments of the context's data source."""
+
+    def write(engine: Engine, context: AnnotationContext):
+        segments = [
+            TranscriptSegment(0, 1000, "hola my friend", 1),
+            TranscriptSegment(1000, 2000, "ok si !", 2),
+        ]
+        with engine.begin() as connection:
+            write_annotations(
+                BulkWriter(connection),
+                IdManagers(engine),
+                annotator.labels,
+                context,
+                segments,
+                predictions,
+                annotator.aggregate(predictions),
+            )
+
+    return write
+
+
+@pytest.fixture
+def corpus(engine: Engine, context: AnnotationContext, write_example) -> Engine:
+    """The DB with the example annotations written for "que pasa"."""
+    write_example(engine, context)
+    return engine
@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+from code_switching.annotation import weighted_vote
+
+
+def test_weighted_vote():
+    winner, confidence = weighted_vote(
+        groups=np.array([0, 0, 0, 1]),
+        values=np.array([1, 0, 0, 2]),
+        weights=np.array([0.5, 0.2, 0.2, 1.0]),
+        n_groups=2,
+        n_values=3,
+    )
+    assert winner.tolist() == [1, 2]
+    assert confidence == pytest.approx([0.5 / 0.9, 1.0])
+
+
+def test_aggregate_words(annotator, predictions):
+    words = annotator.aggregate(predictions)
+
+    assert words.token_word.tolist() == [0, 1, 2, 2, 3, 4, 5]
+    assert words.text_idx.tolist() == [0, 0, 0, 1, 1, 1]
+    assert words.word_idx.tolist() == [0, 1, 2, 0, 1, 2]
+    assert words.surface_form == ["hola", "my", "friend", "ok", "si", "!"]
+
+    lang_values = annotator.labels.lang_values
+    assert [lang_values[i] for i in words.lang] == [
+        "spa",
+        "eng",
+        "eng",
+        "eng",
+        "spa",
+        "n/a",
+    ]
+    # "friend" is voted English by 0.6 to 0.3
+    assert words.lang_confidence[2] == pytest.approx(0.6 / 0.9)
+    pos_labels = annotator.labels.pos_labels
+    assert [pos_labels[i] for i in words.pos] == [
+        "NOUN",
+        "NOUN",
+        "VERB",
+        "VERB",
+        "NOUN",
+        "PUNCT",
+    ]
+    assert words.pos_confidence[2] == pytest.approx(0.6 / 1.0)
+
+
+def test_aggregate_switches(annotator, predictions):
+    words = annotator.aggregate(predictions)
+
+    # (from, into) pairs for hola|my, fri|##end and ok|si, but not across
+    # texts (##end|ok) or into "n/a" (si|!). A "from" is on the token before
+    # the switch and attached to the word after it; an "into" the reverse.
+    assert words.switch_token.tolist() == [0, 1, 2, 3, 4, 5]
+    assert words.switch_word.tolist() == [1, 0, 2, 2, 4, 3]
+    assert words.switch_into.tolist() == [False, True] * 3
+    assert words.switch_confidence == pytest.approx(
+        [0.72, 0.72, 0.18, 0.18, 0.35, 0.35]
+    )
+
+
+def test_aggregate_empty(annotator, predictions):
+    empty = type(predictions)(
+        **{
+            name: value[:0]
+            for name, value in vars(predictions).items()
+            if name != "tokens"
+        },
+        tokens=[],
+    )
+    words = annotator.aggregate(empty)
+    assert len(words.surface_form) == 0
+    assert len(words.switch_token) == 0
@@ -0,0 +1,247 @@
+import csv
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+from code_switching import asr
+from code_switching.asr import (
+    AsrEngine,
+    AsrResult,
+    AsrStats,
+    AudioChunk,
+    EnergyVad,
+    merge_overlaps,
+    overlap_words,
+    stream_chunks,
+    write_csv,
+)
+
+SAMPLING_RATE = 16000
+
+
+def syllables(seconds: float = 10.0, f0: float = 150.0) -> np.ndarray:
+    """
+    Voiced "syllables" of 120-300ms with random pitch and loudness and the
+    occasional pause, roughly the rhythm of speech.
+    """
+    rng = np.random.default_rng(0)
+    parts = []
+    while sum(len(part) for part in parts) < seconds * SAMPLING_RATE:
+        t = np.arange(int(rng.uniform(0.12, 0.3) * SAMPLING_RATE)) / SAMPLING_RATE
+        pitch = f0 * rng.uniform(0.8, 1.25)
+        voiced = sum(np.sin(2 * np.pi * pitch * k * t) / k for k in range(1, 15))
+        parts.append(voiced * np.hanning(len(t)) * rng.uniform(0.3, 1.0))
+        if rng.random() < 0.15:
+            parts.append(np.zeros(int(rng.uniform(0.1, 0.5) * SAMPLING_RATE)))
+    audio = np.concatenate(parts)[: int(seconds * SAMPLING_RATE)]
+    return (0.1 * audio / np.abs(audio).max()).astype(np.float32)
+
+
+def chords(seconds: float = 10.0) -> np.ndarray:
+    """One sustained major chord per second."""
+    t = np.arange(SAMPLING_RATE) / SAMPLING_RATE
+    parts = [
+        sum(np.sin(2 * np.pi * root * ratio * t) for ratio in (1, 1.26, 1.5, 2))
+        for root in [220, 261, 293, 329, 392] * int(seconds / 5)
+    ]
+    audio = np.concatenate(parts)
+    return (0.1 * audio / np.abs(audio).max()).astype(np.float32)
+
+
+def test_vad_rejects_silence():
+    silence = np.zeros(10 * SAMPLING_RATE, dtype=np.float32)
+    assert not EnergyVad().is_speech(silence, SAMPLING_RATE)
+    assert not EnergyVad(reject_music=True).is_speech(silence, SAMPLING_RATE)
+
+
+def test_vad_keeps_low_voices():
+    # Energy in the 80 Hz - 4 kHz band, even at a 110 Hz pitch
+    vad = EnergyVad(min_band_ratio=0.5)
+    assert vad.is_speech(syllables(f0=110.0), SAMPLING_RATE)
+
+
+def test_vad_rejects_sustained_music():
+    assert EnergyVad().is_speech(chords(), SAMPLING_RATE)
+
+    vad = EnergyVad(reject_music=True)
+    assert vad.modulation(chords(), SAMPLING_RATE) < vad.min_modulation
+    assert not vad.is_speech(chords(), SAMPLING_RATE)
+    assert vad.modulation(syllables(), SAMPLING_RATE) > 5 * vad.min_modulation
+    assert vad.is_speech(syllables(), SAMPLING_RATE)
+
+
+def test_overlap_words():
+    previous = "so I went to the store".split()
+    assert overlap_words(previous, "to the Store, and bought".split()) == 3
+    # A word cut off at the chunk's edge
+    assert overlap_words(previous, "to the stor and bought".split()) == 3
+    # One matching word isn't enough
+    assert overlap_words(previous, "store and bought".split()) == 0
+    assert overlap_words(previous, "and then we left".split()) == 0
+    assert overlap_words([], "and".split()) == 0
+
+
+def test_merge_overlaps():
+    start_ms = [0, 20000, 40000, 70000]
+    end_ms = [30000, 50000, 60000, 90000]
+    texts = [
+        [
+            "so I went to the store",
+            "to the store and bought milk",
+            "bought milk and left",
+            "the next day",
+        ]
+    ]
+    assert merge_overlaps(start_ms, end_ms, texts) == [
+        ["so I went to the", "store and bought", "milk and left", "the next day"]
+    ]
+    # The gap left by a dropped chunk is kept
+    assert start_ms == [0, 25000, 45000, 70000]
+    assert end_ms == [25000, 45000, 60000, 90000]
+
+
+def test_write_csv(tmp_path: Path):
+    result = AsrResult(
+        start_ms=np.array([0, 20000]),
+        end_ms=np.array([30000, 50000]),
+        en_prob=np.array([0.9, 0.2]),
+        es_prob=np.array([0.1, 0.8]),
+        en_text=["<|en|> I said hola amigo", "hola amigo okay"],
+        es_text=["dije hola amigo", "hola amigo <|es|> vale"],
+    )
+    write_csv(result, tmp_path / "out.csv")
+    with (tmp_path / "out.csv").open(newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows == [
+        ["start", "end", "text", "en_prob", "es_prob", "en_text", "es_text"],
+        ["0", "25000", "I said hola", "0.9", "0.1", "I said hola", "dije hola"],
+        ["25000", "50000", "amigo vale", "0.2", "0.8", "amigo okay", "amigo vale"],
+    ]
+
+
+class FeatureExtractor:
+    # Passes the audio through as the "features"
+    sampling_rate = 100
+
+    def __call__(self, audio, sampling_rate, return_tensors):
+        return SimpleNamespace(input_features=torch.from_numpy(audio.copy()))
+
+
+class FirstSecondsVad:
+    def is_speech(self, audio, sampling_rate):
+        return audio[0] < 15 * sampling_rate
+
+
+def fake_stream_audio(n_samples: int, block_len: int):
+    def stream_audio(path, sampling_rate):
+        audio = np.arange(n_samples, dtype=np.float32)
+        for start in range(0, n_samples, block_len):
+            yield audio[start : start + block_len]
+
+    return stream_audio
+
+
+def test_stream_chunks(monkeypatch):
+    # 15s chunks overlapping by 5s, so a 37s file has chunks at 0, 10, 20
+    # and 30s, whatever the size of the decoded blocks
+    monkeypatch.setattr(asr, "stream_audio", fake_stream_audio(3700, 700))
+    stats = AsrStats()
+    chunks = list(stream_chunks(Path("a.mp3"), FeatureExtractor(), stats=stats))
+
+    assert [(c.start_ms, c.end_ms) for c in chunks] == [
+        (0, 15000),
+        (10000, 25000),
+        (20000, 35000),
+        (30000, 37000),
+    ]
+    for chunk in chunks:
+        assert chunk.input_features.tolist() == list(
+            range(chunk.start_ms // 10, chunk.end_ms // 10)
+        )
+    assert (stats.chunks, stats.audio_ms) == (4, 37000)
+
+
+def test_stream_chunks_short_tail(monkeypatch):
+    # The last 300ms are inside the previous chunk's overlap
+    monkeypatch.setattr(asr, "stream_audio", fake_stream_audio(3200, 1000))
+    chunks = list(stream_chunks(Path("a.mp3"), FeatureExtractor()))
+    assert [c.start_ms for c in chunks] == [0, 10000, 20000]
+    assert chunks[-1].end_ms == 32000
+
+
+def test_stream_chunks_vad(monkeypatch):
+    monkeypatch.setattr(asr, "stream_audio", fake_stream_audio(3700, 700))
+    stats = AsrStats()
+    chunks = list(
+        stream_chunks(
+            Path("a.mp3"), FeatureExtractor(), vad=FirstSecondsVad(), stats=stats
+        )
+    )
+
+    # Dropped chunks leave a gap, and the others keep their offsets
+    assert [(c.start_ms, c.end_ms) for c in chunks] == [(0, 15000), (10000, 25000)]
+    assert (stats.chunks, stats.skipped_chunks) == (4, 2)
+    # Only the audio not already covered by the previous chunk is counted
+    assert (stats.audio_ms, stats.skipped_ms) == (37000, 12000)
+
+
+class FakeEngine(AsrEngine):
+    """`AsrEngine.transcribe` with a fixed number of chunks per file."""
+
+    def __init__(self, n_chunks, batch_size: int):
+        self.n_chunks = n_chunks
+        self.batch_size = batch_size
+        self.events = []
+
+    def chunks(self, path: Path):
+        for i in range(self.n_chunks[path.name]):
+            self.events.append(f"chunk {path.name}")
+            yield AudioChunk(i * 10000, i * 10000 + 15000, torch.zeros(1))
+
+    def transcribe_batch(self, chunks):
+        self.events.append(f"batch {len(chunks)}")
+        n = len(chunks)
+        return AsrResult(
+            start_ms=np.array([c.start_ms for c in chunks]),
+            end_ms=np.array([c.end_ms for c in chunks]),
+            en_prob=np.full(n, 0.5),
+            es_prob=np.full(n, 0.5),
+            en_text=[f"en {c.start_ms}" for c in chunks],
+            es_text=[f"es {c.start_ms}" for c in chunks],
+        )
+
+
+def test_transcribe_batches_across_files():
+    engine = FakeEngine({"a": 2, "b": 0, "c": 5, "d": 1}, batch_size=3)
+    results = []
+    for path, result in engine.transcribe(Path(name) for name in "abcd"):
+        engine.events.append(f"result {path.name}")
+        results.append((path.name, result.start_ms.tolist(), result.en_text))
+
+    assert results == [
+        ("a", [0, 10000], ["en 0", "en 10000"]),
+        ("b", [], []),
+        ("c", [0, 10000, 20000, 30000, 40000], [f"en {i * 10000}" for i in range(5)]),
+        ("d", [0], ["en 0"]),
+    ]
+    # Batches are filled across files, and a file is yielded as soon as its
+    # last chunk has been transcribed
+    assert engine.events == [
+        "chunk a",
+        "chunk a",
+        "chunk c",
+        "batch 3",
+        "result a",
+        "result b",
+        "chunk c",
+        "chunk c",
+        "chunk c",
+        "batch 3",
+        "chunk c",
+        "chunk d",
+        "batch 2",
+        "result c",
+        "result d",
+    ]
@@ -0,0 +1,93 @@
+import pickle
+from itertools import count
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+from code_switching import cache
+from code_switching.cache import InferenceCache, cache_entries, cache_size
+
+VALUE = b"x" * 100
+SIZE = len(pickle.dumps(VALUE, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    # Every call is one second later, so last uses never tie
+    ticks = count()
+    monkeypatch.setattr(cache, "time", SimpleNamespace(time=lambda: next(ticks)))
+
+
+def total_bytes(inference_cache: InferenceCache) -> int:
+    with inference_cache.engine.connect() as connection:
+        return connection.scalar(select(cache_size.c.total_bytes))
+
+
+def keys(inference_cache: InferenceCache):
+    with inference_cache.engine.connect() as connection:
+        return set(connection.scalars(select(cache_entries.c.key)))
+
+
+def test_key():
+    assert InferenceCache.key("ab", "c") != InferenceCache.key("a", "bc")
+    assert InferenceCache.key("a", b"b") == InferenceCache.key("a", "b")
+
+
+def test_put_and_get(tmp_path: Path):
+    inference_cache = InferenceCache(tmp_path / "cache.db")
+    inference_cache.put_many({"a": VALUE, "b": (1, "two")})
+    assert inference_cache.get_many(["a", "b", "c"]) == {"a": VALUE, "b": (1, "two")}
+    assert inference_cache.get_many([]) == {}
+
+    size = total_bytes(inference_cache)
+    # Replacing an entry only counts its new size
+    inference_cache.put_many({"a": VALUE + VALUE})
+    assert total_bytes(inference_cache) == size - SIZE + len(
+        pickle.dumps(VALUE + VALUE, protocol=pickle.HIGHEST_PROTOCOL)
+    )
+
+
+def test_evicts_least_recently_used(tmp_path: Path):
+    inference_cache = InferenceCache(tmp_path / "cache.db", max_bytes=3 * SIZE)
+    inference_cache.put_many({"a": VALUE})
+    inference_cache.put_many({"b": VALUE, "c": VALUE})
+    assert total_bytes(inference_cache) == 3 * SIZE
+
+    # The hit on "a" is written with the next put, before evicting
+    assert inference_cache.get_many(["a"]) == {"a": VALUE}
+    inference_cache.put_many({"d": VALUE})
+    assert keys(inference_cache) == {"a", "c", "d"}
+    assert total_bytes(inference_cache) == 3 * SIZE
+
+    inference_cache.put_many({"e": VALUE, "f": VALUE})
+    assert keys(inference_cache) == {"d", "e", "f"}
+    assert total_bytes(inference_cache) == 3 * SIZE
+
+
+def test_hits_written_after_interval(tmp_path: Path):
+    inference_cache = InferenceCache(tmp_path / "cache.db", touch_interval_s=10)
+    inference_cache.put_many({"a": VALUE})
+
+    def last_used():
+        with inference_cache.engine.connect() as connection:
+            return connection.scalar(select(cache_entries.c.last_used))
+
+    written = last_used()
+    inference_cache.get_many(["a"])
+    assert last_used() == written
+    for _ in range(10):
+        inference_cache.get_many(["a"])
+    assert last_used() > written
+    assert not inference_cache.touched
+
+
+def test_sizes_existing_cache(tmp_path: Path):
+    inference_cache = InferenceCache(tmp_path / "cache.db")
+    inference_cache.put_many({"a": VALUE, "b": VALUE})
+    with inference_cache.engine.begin() as connection:
+        cache_size.drop(connection)
+    inference_cache.engine.dispose()
+
+    assert total_bytes(InferenceCache(tmp_path / "cache.db")) == 2 * SIZE
@@ -0,0 +1,73 @@
+from pathlib import Path
+
+import numpy as np
+from sqlalchemy import Engine
+from sqlalchemy.orm import Session
+
+from code_switching.annotation import LID_PRETRAINED, POS_PRETRAINED
+from code_switching.columnar import ColumnarCorpus, export_columns
+from code_switching.ingest import AnnotationContext
+
+
+def test_export_columns(corpus: Engine, write_example, tmp_path: Path):
+    with Session(corpus) as session:
+        context = AnnotationContext.fetch(
+            session, "otra", "whisper-small", LID_PRETRAINED, POS_PRETRAINED
+        )
+    write_example(corpus, context)
+
+    export_columns(corpus, tmp_path / "columns")
+    columnar = ColumnarCorpus(tmp_path / "columns")
+    assert columnar.data_source_ids() == [1, 2]
+
+    surface_forms = columnar.dictionary("surface_form")
+    assert surface_forms.tolist() == sorted(["hola", "my", "friend", "ok", "si", "!"])
+    values = columnar.dictionary("value")
+
+    with corpus.connect() as connection:
+        for data_source_id in [1, 2]:
+            segments = columnar.table(data_source_id, "segments")
+            assert isinstance(segments["id"], np.memmap)
+            assert segments["start_ms"].tolist() == [0, 1000]
+            assert (
+                connection.exec_driver_sql(
+                    "SELECT id FROM Segments WHERE data_source_id = ? ORDER BY id",
+                    (data_source_id,),
+                )
+                .scalars()
+                .all()
+                == segments["id"].tolist()
+            )
+
+            words = columnar.table(data_source_id, "words")
+            assert words["word_index"].dtype == np.int32
+            assert surface_forms[words["surface_form"]].tolist() == [
+                "hola",
+                "my",
+                "friend",
+                "ok",
+                "si",
+                "!",
+            ]
+            assert np.isin(words["segment_id"], segments["id"]).all()
+
+            annotations = columnar.table(data_source_id, "word_annotations")
+            rows = connection.exec_driver_sql(
+                "SELECT a.word_id, a.value, a.confidence FROM WordAnnotations AS a "
+                "JOIN Words AS w ON w.id = a.word_id "
+                "JOIN Segments AS s ON s.id = w.segment_id "
+                "WHERE s.data_source_id = ? ORDER BY a.id",
+                (data_source_id,),
+            ).all()
+            assert annotations["word_id"].tolist() == [row[0] for row in rows]
+            assert values[annotations["value"]].tolist() == [row[1] for row in rows]
+            assert annotations["confidence"].tolist() == [
+                np.float32(row[2]) for row in rows
+            ]
+
+
+def test_export_empty(engine: Engine, tmp_path: Path):
+    export_columns(engine, tmp_path / "columns")
+    columnar = ColumnarCorpus(tmp_path / "columns")
+    assert columnar.data_source_ids() == []
+    assert len(columnar.dictionary("surface_form")) == 0
@@ -0,0 +1,46 @@
+from pathlib import Path
+
+import pytest
+from sqlalchemy import Engine, create_engine
+
+from code_switching.export import export_ui_db
+
+
+def rows(engine: Engine, sql: str):
+    with engine.connect() as connection:
+        return [tuple(row) for row in connection.exec_driver_sql(sql)]
+
+
+def test_export_ui_db(corpus: Engine, tmp_path: Path):
+    # Quotes in the path are bound, not pasted into the SQL
+    source = tmp_path / "it's" / "corpus.db"
+    source.parent.mkdir()
+    with corpus.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.exec_driver_sql("VACUUM INTO ?", (str(source),))
+
+    target = tmp_path / "ui.db"
+    export_ui_db(source, target)
+    # Exporting again replaces the read-only file
+    export_ui_db(source, target)
+    assert not target.stat().st_mode & 0o222
+
+    ui = create_engine(f"sqlite:///{target}")
+    assert rows(ui, "PRAGMA page_size") == [(1024,)]
+    assert rows(ui, "PRAGMA journal_mode") == [("delete",)]
+    for sql in [
+        "SELECT id, name, url, creator FROM DataSources ORDER BY id",
+        "SELECT id, name FROM AnnotationTypes ORDER BY id",
+        "SELECT id, start_ms, end_ms, data_source_id FROM Segments ORDER BY id",
+        "SELECT id, surface_form, segment_id, word_index FROM Words ORDER BY id",
+        "SELECT id, value, word_id, annotation_type_id FROM WordAnnotations "
+        "ORDER BY id",
+    ]:
+        assert rows(ui, sql) == rows(corpus, sql)
+    assert rows(ui, "SELECT count(*) FROM Words") == [(6,)]
+    ui.dispose()
+
+
+def test_export_onto_itself(corpus: Engine, tmp_path: Path):
+    with pytest.raises(ValueError):
+        export_ui_db(tmp_path / "corpus.db", tmp_path / "." / "corpus.db")
+    assert rows(corpus, "SELECT count(*) FROM Words") == [(6,)]
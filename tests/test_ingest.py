@@ -0,0 +1,210 @@
+import csv
+from pathlib import Path
+
+import numpy as np
+import pytest
+from sqlalchemy import Engine
+
+from code_switching.ingest import IdAllocator, TranscriptSegment, read_segments
+from code_switching.schema import Segment
+
+
+def query(engine: Engine, sql: str):
+    with engine.connect() as connection:
+        return [tuple(row) for row in connection.exec_driver_sql(sql)]
+
+
+def test_write_annotations(corpus: Engine):
+    assert query(
+        corpus,
+        "SELECT s.start_ms, w.word_index, w.surface_form FROM Words AS w "
+        "JOIN Segments AS s ON s.id = w.segment_id ORDER BY w.id",
+    ) == [
+        (0, 0, "hola"),
+        (0, 1, "my"),
+        (0, 2, "friend"),
+        (1000, 0, "ok"),
+        (1000, 1, "si"),
+        (1000, 2, "!"),
+    ]
+    assert query(
+        corpus,
+        "SELECT t.surface_form, t.token_index, w.surface_form FROM Tokens AS t "
+        "JOIN Words AS w ON w.id = t.word_id ORDER BY t.id",
+    ) == [
+        ("hola", 1, "hola"),
+        ("my", 2, "my"),
+        ("fri", 3, "friend"),
+        ("##end", 4, "friend"),
+        ("ok", 1, "ok"),
+        ("si", 2, "si"),
+        ("!", 3, "!"),
+    ]
+
+    # Grouped per word: language, pos, then switches in the order found
+    assert query(
+        corpus,
+        "SELECT w.surface_form, t.name, a.value, round(a.confidence, 4) "
+        "FROM WordAnnotations AS a JOIN Words AS w ON w.id = a.word_id "
+        "JOIN AnnotationTypes AS t ON t.id = a.annotation_type_id ORDER BY a.id",
+    ) == [
+        ("hola", "language", "spa", 1.0),
+        ("hola", "pos", "NOUN", 1.0),
+        ("hola", "switch", "into", 0.72),
+        ("my", "language", "eng", 1.0),
+        ("my", "pos", "NOUN", 1.0),
+        ("my", "switch", "from", 0.72),
+        ("friend", "language", "eng", 0.6667),
+        ("friend", "pos", "VERB", 0.6),
+        ("friend", "switch", "from", 0.18),
+        ("friend", "switch", "into", 0.18),
+        ("ok", "language", "eng", 1.0),
+        ("ok", "pos", "VERB", 1.0),
+        ("ok", "switch", "into", 0.35),
+        ("si", "language", "spa", 1.0),
+        ("si", "pos", "NOUN", 1.0),
+        ("si", "switch", "from", 0.35),
+        ("!", "language", "n/a", 1.0),
+        ("!", "pos", "PUNCT", 1.0),
+    ]
+
+    # Token annotations point at the word annotation they were
+    # aggregated into; switch annotations at the word they're attached to
+    assert query(
+        corpus,
+        "SELECT t.surface_form, ty.name, a.value, round(a.confidence, 4), "
+        "w.surface_form, wa.value "
+        "FROM TokenAnnotations AS a JOIN Tokens AS t ON t.id = a.token_id "
+        "JOIN AnnotationTypes AS ty ON ty.id = a.annotation_type_id "
+        "JOIN WordAnnotations AS wa ON wa.id = a.word_annotation_id "
+        "JOIN Words AS w ON w.id = wa.word_id "
+        "WHERE ty.name = 'switch' ORDER BY a.word_annotation_id",
+    ) == [
+        ("my", "switch", "into", 0.72, "hola", "into"),
+        ("hola", "switch", "from", 0.72, "my", "from"),
+        ("fri", "switch", "from", 0.18, "friend", "from"),
+        ("##end", "switch", "into", 0.18, "friend", "into"),
+        ("si", "switch", "into", 0.35, "ok", "into"),
+        ("ok", "switch", "from", 0.35, "si", "from"),
+    ]
+    assert query(
+        corpus,
+        "SELECT t.surface_form, a.value, round(a.confidence, 4) "
+        "FROM TokenAnnotations AS a JOIN Tokens AS t ON t.id = a.token_id "
+        "JOIN AnnotationTypes AS ty ON ty.id = a.annotation_type_id "
+        "WHERE ty.name = 'language' ORDER BY t.id",
+    ) == [
+        ("hola", "spa", 0.9),
+        ("my", "eng", 0.8),
+        ("fri", "eng", 0.6),
+        ("##end", "spa", 0.3),
+        ("ok", "eng", 0.7),
+        ("si", "spa", 0.5),
+        ("!", "n/a", 0.99),
+    ]
+
+
+def test_switch_points(corpus: Engine):
+    # One row per switch, on the word after it
+    assert query(
+        corpus,
+        "SELECT s.start_ms, w.surface_form, p.from_lang, p.into_lang, "
+        "round(p.confidence, 4) FROM SwitchPoints AS p "
+        "JOIN Words AS w ON w.id = p.word_id "
+        "JOIN Segments AS s ON s.id = p.segment_id ORDER BY p.id",
+    ) == [
+        (0, "my", "spa", "eng", 0.72),
+        (0, "friend", "eng", "spa", 0.18),
+        (1000, "si", "eng", "spa", 0.35),
+    ]
+
+
+def write_transcript(path: Path, rows) -> Path:
+    with path.open("w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["start", "end", "text"])
+        writer.writerows(rows)
+    return path
+
+
+@pytest.fixture
+def transcript(tmp_path: Path) -> Path:
+    return write_transcript(
+        tmp_path / "episode.csv",
+        [
+            (0, 1000, " >Hola, [Music] como"),
+            (1000, 2000, "estas?"),
+            (2000, 3000, "[Applause]"),
+            (3000, 4000, "I am fine."),
+            (4000, 5000, "and then"),
+            (5000, 6000, "no punctuation"),
+        ],
+    )
+
+
+def test_read_segments(transcript: Path):
+    assert list(read_segments(transcript)) == [
+        TranscriptSegment(0, 2000, "Hola, como estas?", 2),
+        TranscriptSegment(3000, 4000, "I am fine.", 4),
+        # The unfinished sentence at the end is kept
+        TranscriptSegment(4000, 6000, "and then no punctuation", 6),
+    ]
+
+
+def test_read_segments_caps(transcript: Path):
+    assert list(read_segments(transcript, max_words=2)) == [
+        TranscriptSegment(0, 1000, "Hola, como", 1),
+        TranscriptSegment(1000, 2000, "estas?", 2),
+        TranscriptSegment(3000, 4000, "I am fine.", 4),
+        TranscriptSegment(4000, 5000, "and then", 5),
+        TranscriptSegment(5000, 6000, "no punctuation", 6),
+    ]
+    assert list(read_segments(transcript, max_ms=1500)) == [
+        TranscriptSegment(0, 2000, "Hola, como estas?", 2),
+        TranscriptSegment(3000, 4000, "I am fine.", 4),
+        TranscriptSegment(4000, 6000, "and then no punctuation", 6),
+    ]
+    assert list(read_segments(transcript, max_ms=1000)) == [
+        TranscriptSegment(0, 1000, "Hola, como", 1),
+        TranscriptSegment(1000, 2000, "estas?", 2),
+        TranscriptSegment(3000, 4000, "I am fine.", 4),
+        TranscriptSegment(4000, 5000, "and then", 5),
+        TranscriptSegment(5000, 6000, "no punctuation", 6),
+    ]
+
+
+def test_read_segments_resume(transcript: Path):
+    segments = list(read_segments(transcript, max_words=2))
+    for i, segment in enumerate(segments):
+        assert list(read_segments(transcript, segment.next_row, max_words=2)) == (
+            segments[i + 1 :]
+        )
+
+
+def test_id_allocator_blocks(engine: Engine):
+    table = Segment.__table__
+    with engine.begin() as connection:
+        connection.execute(
+            table.insert(),
+            [{"id": 41, "start_ms": 0, "end_ms": 1000, "data_source_id": 1}],
+        )
+
+    first = IdAllocator(engine, table, block_size=10)  # type: ignore
+    second = IdAllocator(engine, table, block_size=10)  # type: ignore
+    # Sequences start after the highest existing id, and each allocator
+    # hands out ids from its own reserved block
+    assert first.next_ids(3).tolist() == [42, 43, 44]
+    assert second.next_ids(3).tolist() == [52, 53, 54]
+    assert first.next_ids(7).tolist() == list(range(45, 52))
+    # A request larger than what is left reserves a block big enough
+    assert first.next_ids(12).tolist() == list(range(62, 74))
+    assert second.next_ids(8).tolist() == [55, 56, 57, 58, 59, 60, 61, 74]
+
+
+def test_id_allocators_never_overlap(engine: Engine):
+    table = Segment.__table__
+    allocators = [IdAllocator(engine, table, block_size=5) for _ in range(3)]  # type: ignore
+    ids = np.concatenate(
+        [allocators[i % 3].next_ids(n) for i, n in enumerate([1, 4, 7, 2, 9, 3, 5])]
+    )
+    assert len(np.unique(ids)) == len(ids)
@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+from code_switching.pipelining import pipelined
+
+
+def test_pipelined_order():
+    stages = [lambda x: x * 2, lambda x: x + 1, str]
+    assert list(pipelined(range(10), stages)) == [str(2 * i + 1) for i in range(10)]
+    assert list(pipelined([], stages)) == []
+
+
+def test_pipelined_overlaps_stages():
+    # Each stage sleeps while the other one works
+    def slow(x):
+        time.sleep(0.05)
+        return x
+
+    start = time.perf_counter()
+    assert list(pipelined(range(10), [slow, slow])) == list(range(10))
+    assert time.perf_counter() - start < 0.9
+
+
+def fail_on(n):
+    def stage(x):
+        if x == n:
+            raise ValueError(x)
+        return x
+
+    return stage
+
+
+def test_pipelined_stage_error():
+    results = []
+    with pytest.raises(ValueError, match="3"):
+        for item in pipelined(range(100), [fail_on(3), fail_on(-1)]):
+            results.append(item)
+    # Outputs still in flight when the error happens are dropped
+    assert results == list(range(len(results)))
+    assert len(results) <= 3
+
+
+def test_pipelined_items_error():
+    def items():
+        yield from range(3)
+        raise KeyError("feed")
+
+    with pytest.raises(KeyError):
+        list(pipelined(items(), [fail_on(-1)]))
+
+
+def test_pipelined_close():
+    threads = threading.active_count()
+    fed = []
+
+    def items():
+        for i in range(1000):
+            fed.append(i)
+            yield i
+
+    outputs = pipelined(items(), [fail_on(-1), fail_on(-1)], maxsize=2)
+    assert next(outputs) == 0
+    outputs.close()
+    # Stopped threads don't keep consuming the input
+    assert threading.active_count() == threads
+    assert len(fed) < 10
@@ -0,0 +1,58 @@
+import pytest
+from sqlalchemy import Engine
+
+from code_switching.schema import bulk_load, query_indexes
+
+
+def index_names(engine: Engine):
+    with engine.connect() as connection:
+        return {
+            row[0]
+            for row in connection.exec_driver_sql(
+                "SELECT name FROM sqlite_master WHERE type = 'index'"
+            )
+        }
+
+
+def has_stats(engine: Engine) -> bool:
+    with engine.connect() as connection:
+        return bool(
+            connection.exec_driver_sql(
+                "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+            ).first()
+        )
+
+
+ALL_INDEXES = {index.name for index in query_indexes()}
+
+
+def test_bulk_load_empty(engine: Engine):
+    assert ALL_INDEXES <= index_names(engine)
+    with bulk_load(engine):
+        assert not ALL_INDEXES & index_names(engine)
+    assert ALL_INDEXES <= index_names(engine)
+    assert has_stats(engine)
+
+
+def test_bulk_load_keeps_indexes(corpus: Engine):
+    with bulk_load(corpus):
+        assert ALL_INDEXES <= index_names(corpus)
+    assert ALL_INDEXES <= index_names(corpus)
+
+
+def test_bulk_load_error(engine: Engine):
+    with pytest.raises(RuntimeError):
+        with bulk_load(engine):
+            raise RuntimeError("load failed")
+    assert ALL_INDEXES <= index_names(engine)
+
+
+def test_bulk_load_overlapping(engine: Engine):
+    # Two loaders that both saw an empty DB drop and rebuild the same indexes
+    first, second = bulk_load(engine), bulk_load(engine)
+    first.__enter__()
+    second.__enter__()
+    first.__exit__(None, None, None)
+    assert ALL_INDEXES <= index_names(engine)
+    second.__exit__(None, None, None)
+    assert ALL_INDEXES <= index_names(engine)
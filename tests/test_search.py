@@ -0,0 +1,40 @@
+import pytest
+from sqlalchemy import Engine
+
+from code_switching.schema import open_db
+from code_switching.search import match_expression, search
+
+
+def test_match_expression():
+    assert match_expression('ho* "x') == 'surface_form : ("ho"* OR """x")'
+    assert match_expression("hola", lang="spa", pos="NOUN") == (
+        'surface_form : ("hola") AND lang : "spa" AND pos : "NOUN"'
+    )
+    with pytest.raises(ValueError):
+        match_expression("  ")
+
+
+def hits(engine: Engine, query: str, **kwargs):
+    with engine.connect() as connection:
+        return [hit.start_ms for hit in search(connection, query, **kwargs)]
+
+
+def test_search(corpus: Engine):
+    assert hits(corpus, "friend") == [0]
+    # Case and accents are ignored
+    assert hits(corpus, "HÓLA") == [0]
+    assert hits(corpus, "fri*") == [0]
+    assert hits(corpus, "friend si") == [0, 1000]
+    assert hits(corpus, "friend si", lang="spa") == [1000]
+    assert hits(corpus, "my ok", pos="VERB") == [1000]
+    assert hits(corpus, "friend si", limit=1) == [0]
+    assert hits(corpus, "fri") == []
+
+
+def test_search_index_filled_on_open(corpus: Engine, tmp_path):
+    with corpus.begin() as connection:
+        connection.exec_driver_sql("DROP TABLE WordSearch")
+    corpus.dispose()
+
+    engine = open_db(tmp_path / "corpus.db")
+    assert hits(engine, "friend si") == [0, 1000]
@@ -0,0 +1,64 @@
+from pathlib import Path
+
+import pytest
+from sqlalchemy.orm import Session
+
+from code_switching.annotation import LID_PRETRAINED, POS_PRETRAINED
+from code_switching.ingest import AnnotationContext
+from code_switching.schema import bulk_load
+from code_switching.search import search
+from code_switching.shards import SHARD_ID_BITS, ShardedCorpus
+
+
+@pytest.fixture
+def sharded(data_dir: Path, write_example) -> ShardedCorpus:
+    corpus = ShardedCorpus(data_dir / "sharded")
+    for source_name in ["que pasa", "otra"]:
+        engine = corpus.shard(corpus.data_source_id(source_name))
+        with Session(engine) as session:
+            context = AnnotationContext.fetch(
+                session, source_name, "whisper-small", LID_PRETRAINED, POS_PRETRAINED
+            )
+        with bulk_load(engine):
+            write_example(engine, context)
+    return corpus
+
+
+def test_shard_ids(sharded: ShardedCorpus):
+    for data_source_id in [1, 2]:
+        with sharded.shard(data_source_id).connect() as connection:
+            ids = connection.exec_driver_sql("SELECT id FROM Words").scalars().all()
+        assert min(ids) == data_source_id << SHARD_ID_BITS
+
+
+def test_attach_and_search(sharded: ShardedCorpus):
+    with sharded.connect() as connection:
+        sharded.attach(connection, [1])
+        assert [hit.data_source_id for hit in search(connection, "friend")] == [1]
+
+        # Attaching again, or a shard that doesn't exist, changes nothing
+        sharded.attach(connection, [1, 2, 3])
+        sharded.attach(connection, [2])
+        hits = search(connection, "friend si")
+        assert [(hit.data_source_id, hit.start_ms) for hit in hits] == [
+            (1, 0),
+            (1, 1000),
+            (2, 0),
+            (2, 1000),
+        ]
+        assert [
+            hit.data_source_id for hit in search(connection, "si", data_source_id=2)
+        ] == [2]
+        # The views combine the shards
+        assert connection.exec_driver_sql("SELECT count(*) FROM Words").scalar() == 12
+
+
+def test_shard_loads_leave_catalog_alone(sharded: ShardedCorpus):
+    with sharded.connect() as connection:
+        assert not connection.exec_driver_sql(
+            "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+        ).first()
+        sharded.attach(connection, [1])
+        assert connection.exec_driver_sql(
+            "SELECT 1 FROM shard_1.sqlite_master WHERE name = 'sqlite_stat1'"
+        ).first()